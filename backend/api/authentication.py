@@ -0,0 +1,74 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+
+from api.cache import get_version
+from api.metrics import record_cache
+
+
+class TokenCache:
+    """LRU-кэш токенов в памяти процесса, сверяемый с версией в общем кэше"""
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, user, token, cached_version = entry
+            if expires < time.monotonic() or cached_version != version:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        return copy.copy(user), token
+
+    def set(self, key, user, token, version):
+        with self.lock:
+            self.entries[key] = (
+                time.monotonic() + self.timeout, copy.copy(user), token,
+                version
+            )
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def delete_user(self, user_id):
+        with self.lock:
+            for key in [
+                key for key, (_, user, _, _) in self.entries.items()
+                if user.pk == user_id
+            ]:
+                del self.entries[key]
+
+
+token_cache = TokenCache(
+    settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TIMEOUT
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        # Выход или блокировка в другом воркере сдвигает версию токена
+        # в общем кэше. Версия читается до базы, чтобы не закэшировать
+        # пользователя, измененного между двумя чтениями.
+        version = get_version('token', key)
+        cached = token_cache.get(key, version)
+        record_cache('token', cached is not None, cached is None)
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user, token, version)
+        return user, token
@@ -0,0 +1,49 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def version_key(*parts):
+    return ':'.join(('version', *map(str, parts)))
+
+
+def get_version(*parts):
+    """Текущая версия набора данных для ключей кэша"""
+    key = version_key(*parts)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(*names):
+    """Версии нескольких наборов данных за одно обращение к кэшу"""
+    keys = [version_key(*parts) for parts in names]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, time.time_ns(), None)
+        versions.update(cache.get_many(missing))
+    return [versions[key] for key in keys]
+
+
+def bump_version(*parts):
+    key = version_key(*parts)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def bump_version_on_commit(*parts):
+    # До коммита параллельный запрос увидел бы новую версию со старыми
+    # строками и сохранил бы устаревший фрагмент под новым ключом.
+    transaction.on_commit(lambda: bump_version(*parts))
+
+
+def make_etag(*parts):
+    return hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
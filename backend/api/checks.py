@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(deploy=True)
+def shared_cache_check(app_configs, **kwargs):
+    """Версии ETag и журнал индекса работают только с общим кэшем"""
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.DEBUG or backend not in LOCAL_CACHES:
+        return []
+    return [Error(
+        f'Кэш {backend} не разделяется между воркерами: '
+        'ETag, фрагменты рецептов и индексы будут устаревать.',
+        hint='Укажите CACHE_BACKEND с memcached или файловым кэшем.',
+        id='api.E001',
+    )]
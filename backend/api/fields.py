@@ -0,0 +1,48 @@
+from django.conf import settings
+from drf_extra_fields.fields import Base64FieldMixin
+from rest_framework import serializers
+
+
+class Base64ImageUploadField(Base64FieldMixin, serializers.FileField):
+    """Картинка в base64: формат определяется по сигнатуре, без Pillow"""
+    ALLOWED_TYPES = ('jpg', 'png', 'gif', 'webp')
+    INVALID_FILE_MESSAGE = 'Загрузите корректное изображение.'
+    INVALID_TYPE_MESSAGE = 'Неподдерживаемый формат изображения.'
+    SIGNATURES = (
+        (b'\xff\xd8\xff', 'jpg'),
+        (b'\x89PNG\r\n\x1a\n', 'png'),
+        (b'GIF87a', 'gif'),
+        (b'GIF89a', 'gif'),
+    )
+
+    def get_file_extension(self, filename, decoded_file):
+        if len(decoded_file) > settings.RECIPE_IMAGE_MAX_UPLOAD_SIZE:
+            raise serializers.ValidationError('Слишком большое изображение.')
+        for signature, extension in self.SIGNATURES:
+            if decoded_file.startswith(signature):
+                return extension
+        if decoded_file[:4] == b'RIFF' and decoded_file[8:12] == b'WEBP':
+            return 'webp'
+        return None
+
+
+class ImageVariantsField(serializers.Field):
+    """Ссылки на уменьшенные копии картинки: {размер: {формат: url}}"""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, variants):
+        storage = self.parent.Meta.model._meta.get_field('image').storage
+        request = self.context.get('request')
+        return {
+            label: {
+                image_format: (
+                    request.build_absolute_uri(storage.url(name))
+                    if request else storage.url(name)
+                )
+                for image_format, name in formats.items()
+            }
+            for label, formats in variants.items()
+        }
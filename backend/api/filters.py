@@ -25,17 +25,23 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = BooleanFilter(
         method='get_is_in_shopping_cart'
     )
+    search = CharFilter(method='get_search')
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'tags', 'author', 'is_favorited', 'is_in_shopping_cart', 'search'
+        )
 
     def get_is_favorited(self, queryset, name, value):
         if value:
-            return queryset.filter(favourites__user=self.request.user)
+            return queryset.filter(is_favorited=True)
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         if value:
-            return queryset.filter(shopping_list__user=self.request.user)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
+
+    def get_search(self, queryset, name, value):
+        return queryset.search(value)
@@ -0,0 +1,212 @@
+import bisect
+import heapq
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from api.cache import bump_version, get_version, version_key
+from recipes.models import Ingredient, IngredientInRecipe
+
+EMPTY = np.empty(0, dtype=np.int64)
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для поиска по началу названия"""
+    separators = (' ', '-', '(', ',')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.data = ([], [])
+
+    def build(self):
+        ingredients = sorted(
+            Ingredient.objects.all(),
+            key=lambda ingredient: (ingredient.name.casefold(), ingredient.pk)
+        )
+        keys = [ingredient.name.casefold() for ingredient in ingredients]
+        return keys, ingredients
+
+    def get_data(self):
+        version = get_version(Ingredient._meta.label_lower)
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.data = self.build()
+                    self.version = version
+        return self.data
+
+    def search(self, query, limit=None):
+        query = query.casefold()
+        keys, ingredients = self.get_data()
+        result = []
+        position = bisect.bisect_left(keys, query)
+        while position < len(keys) and keys[position].startswith(query):
+            if limit is not None and len(result) >= limit:
+                return result
+            result.append(ingredients[position])
+            position += 1
+        matches = (
+            (self.rank(key, query), position)
+            for position, key in enumerate(keys)
+            if query in key and not key.startswith(query)
+        )
+        if limit is None:
+            matches = sorted(matches)
+        else:
+            matches = heapq.nsmallest(limit - len(result), matches)
+        return result + [ingredients[position] for _, position in matches]
+
+    def rank(self, key, query):
+        start = key.find(query)
+        word_start = key[start - 1] in self.separators
+        return not word_start, start, len(key)
+
+
+class RecipeIngredientIndex:
+    """Инвертированный индекс: ингредиент -> отсортированные id рецептов"""
+    name = 'recipe-ingredient-index'
+    changes_timeout = 24 * 60 * 60
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        # postings, id рецептов, число ингредиентов в каждом из них
+        # и обратный индекс: рецепт -> его ингредиенты
+        self.data = ({}, EMPTY, EMPTY, {})
+
+    def record_change(self, recipe_id):
+        """Записывает изменение рецепта в общий журнал в кэше"""
+        key = version_key(self.name)
+        try:
+            number = cache.incr(key)
+        except ValueError:
+            return
+        cache.set(f'{key}:{number}', recipe_id, self.changes_timeout)
+
+    def reset(self):
+        """Заставляет все процессы перестроить индекс целиком"""
+        bump_version(self.name)
+
+    def group(self, pairs):
+        order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+        pairs = pairs[order]
+        ingredients, starts = np.unique(pairs[:, 0], return_index=True)
+        return dict(zip(
+            ingredients.tolist(), np.split(pairs[:, 1], starts[1:])
+        ))
+
+    def fetch(self, recipe_ids=None):
+        rows = IngredientInRecipe.objects.order_by()
+        if recipe_ids is not None:
+            rows = rows.filter(recipe_id__in=recipe_ids)
+        return np.array(
+            list(rows.values_list('ingredient_id', 'recipe_id').iterator()),
+            dtype=np.int64
+        ).reshape(-1, 2)
+
+    def build(self):
+        pairs = self.fetch()
+        recipes, sizes = np.unique(pairs[:, 1], return_counts=True)
+        return self.group(pairs), recipes, sizes, self.group(pairs[:, ::-1])
+
+    def apply(self, data, recipe_ids):
+        postings, recipes, sizes, contents = data
+        changed = np.array(sorted(recipe_ids), dtype=np.int64)
+        pairs = self.fetch(recipe_ids)
+        removed = np.searchsorted(recipes, [
+            recipe_id for recipe_id in changed.tolist()
+            if recipe_id in contents
+        ])
+        # Обратный индекс дает старые ингредиенты изменившихся рецептов,
+        # поэтому чистятся только их postings, а не весь индекс.
+        contents, stale = dict(contents), set()
+        for recipe_id in changed.tolist():
+            stale.update(contents.pop(recipe_id, EMPTY).tolist())
+        contents.update(self.group(pairs[:, ::-1]))
+        # search читает postings без блокировки, словарь меняется в копии.
+        postings = dict(postings)
+        for ingredient in stale:
+            posting = postings[ingredient]
+            posting = posting[~np.isin(posting, changed)]
+            if len(posting):
+                postings[ingredient] = posting
+            else:
+                del postings[ingredient]
+        for ingredient, posting in self.group(pairs).items():
+            postings[ingredient] = np.union1d(
+                postings.get(ingredient, EMPTY), posting
+            )
+        recipes = np.delete(recipes, removed)
+        sizes = np.delete(sizes, removed)
+        new_recipes, new_sizes = np.unique(pairs[:, 1], return_counts=True)
+        positions = np.searchsorted(recipes, new_recipes)
+        return (
+            postings,
+            np.insert(recipes, positions, new_recipes),
+            np.insert(sizes, positions, new_sizes),
+            contents
+        )
+
+    def get_data(self):
+        version = get_version(self.name)
+        if version == self.version:
+            return self.data
+        with self.lock:
+            if version == self.version:
+                return self.data
+            changes = {}
+            if self.version is not None and 0 < version - self.version <= (
+                settings.RECIPE_INDEX_MAX_CHANGES
+            ):
+                key = version_key(self.name)
+                keys = [
+                    f'{key}:{number}'
+                    for number in range(self.version + 1, version + 1)
+                ]
+                changes = cache.get_many(keys)
+                if len(changes) < len(keys):
+                    changes = {}
+            if changes:
+                self.data = self.apply(self.data, set(changes.values()))
+            else:
+                self.data = self.build()
+            self.version = version
+        return self.data
+
+    def search(self, ingredient_ids, require_all=False, max_missing=None,
+               limit=None):
+        """Рецепты, отсортированные по совпадению с набором ингредиентов
+
+        Возвращает тройки (id рецепта, совпало, не хватает).
+        """
+        postings, recipes, sizes, _ = self.get_data()
+        matched = [postings.get(pk, EMPTY) for pk in set(ingredient_ids)]
+        if not matched or not len(recipes):
+            return []
+        if require_all:
+            matched.sort(key=len)
+            ids = matched[0]
+            for posting in matched[1:]:
+                ids = np.intersect1d(ids, posting, assume_unique=True)
+            overlap = np.full(len(ids), len(matched))
+        else:
+            ids, overlap = np.unique(
+                np.concatenate(matched), return_counts=True
+            )
+        missing = sizes[np.searchsorted(recipes, ids)] - overlap
+        if max_missing is not None:
+            fits = missing <= max_missing
+            ids, overlap, missing = ids[fits], overlap[fits], missing[fits]
+        order = np.lexsort((-ids, missing, -overlap))[:limit]
+        return list(zip(
+            ids[order].tolist(),
+            overlap[order].tolist(),
+            missing[order].tolist()
+        ))
+
+
+ingredient_index = IngredientIndex()
+recipe_index = RecipeIngredientIndex()
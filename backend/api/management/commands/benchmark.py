@@ -0,0 +1,364 @@
+import base64
+import io
+import json
+import math
+import time
+from itertools import combinations
+
+from django.core.cache import cache
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import Favourites, Ingredient, Recipe, ShoppingList, Tag
+from users.models import Follow, User
+
+TRANSACTION_STATEMENTS = (
+    'BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK'
+)
+PASSWORD = 'benchmark-password'
+BULK_SIZE = 10
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время ответа, число запросов и размер ответов API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=2,
+            help='Количество прогонов без замеров'
+        )
+        parser.add_argument(
+            '--cold',
+            action='store_true',
+            help='Очищать кэш перед каждым запросом'
+        )
+        parser.add_argument(
+            '--user',
+            help='Почта пользователя, от имени которого идут запросы'
+        )
+        parser.add_argument('--only', help='Подстрока имени сценария')
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+        parser.add_argument(
+            '--baseline',
+            help='Файл с эталонными замерами: benchmarks/baseline.json'
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.2,
+            help='Допустимый относительный рост p95'
+        )
+        parser.add_argument(
+            '--min-delta',
+            type=float,
+            default=5.0,
+            help='Рост p95 в миллисекундах, который не считается регрессией'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Сравнивать с эталоном, даже если условия замеров другие'
+        )
+
+    def get_user(self, email):
+        if email:
+            try:
+                return User.objects.get(email=email)
+            except User.DoesNotExist:
+                raise CommandError(f'Пользователь {email} не найден')
+        # Нужен автор, иначе сценарии правки и удаления рецепта вернут 403.
+        user = User.objects.filter(
+            pk__in=Recipe.objects.values('author')
+        ).annotate(total=Count('follower')).order_by('-total', 'id').first()
+        if user is None:
+            raise CommandError(
+                'База пуста: сначала выполните generate_dataset'
+            )
+        return user
+
+    def image(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 48), 'orange').save(buffer, 'PNG')
+        encoded = base64.b64encode(buffer.getvalue()).decode()
+        return f'data:image/png;base64,{encoded}'
+
+    def get_cases(self, user):
+        recipe = Recipe.objects.order_by('-favourites_count').first()
+        own = Recipe.objects.filter(author=user).first() or recipe
+        tag = Tag.objects.first()
+        ingredient = Ingredient.objects.order_by('id').first()
+        authors = list(User.objects.exclude(pk=user.pk).exclude(
+            following__user=user
+        ).order_by('id').values_list('id', flat=True)[:BULK_SIZE])
+        followed = list(Follow.objects.filter(user=user).order_by(
+            'author_id'
+        ).values_list('author_id', flat=True)[:BULK_SIZE])
+        favourites = self.missing(Favourites, user)
+        favourited = self.present(Favourites, user)
+        carts = self.missing(ShoppingList, user)
+        carted = self.present(ShoppingList, user)
+        payload = {
+            'ingredients': [
+                {'id': pk, 'amount': amount} for amount, pk in enumerate(
+                    Ingredient.objects.order_by('id').values_list(
+                        'id', flat=True
+                    )[:8], 1
+                )
+            ],
+            'tags': list(Tag.objects.values_list('id', flat=True)),
+            'name': 'Тестовый рецепт',
+            'text': 'Описание',
+            'cooking_time': 15,
+            'image': self.image()
+        }
+        filters = {
+            'tags': f'tags={tag.slug}' if tag else '',
+            'author': f'author={recipe.author_id}' if recipe else '',
+            'is_favorited': 'is_favorited=1',
+            'is_in_shopping_cart': 'is_in_shopping_cart=1'
+        }
+        cases = [
+            ('tags-list', 'get', '/api/tags/', None),
+            ('ingredients-list', 'get', '/api/ingredients/', None),
+            ('ingredients-search', 'get', '/api/ingredients/?name=сах',
+             None),
+            ('users-list', 'get', '/api/users/', None),
+            ('users-me', 'get', '/api/users/me/', None),
+            ('users-subscriptions', 'get',
+             '/api/users/subscriptions/?recipes_limit=3', None),
+            ('recipes-cursor', 'get', '/api/recipes/?pagination=cursor',
+             None),
+            ('recipes-create', 'post', '/api/recipes/', payload),
+            ('shopping-cart-txt', 'get',
+             '/api/recipes/download_shopping_cart/?format=txt', None),
+            ('shopping-cart-csv', 'get',
+             '/api/recipes/download_shopping_cart/?format=csv', None),
+            ('shopping-cart-json', 'get',
+             '/api/recipes/download_shopping_cart/?format=json', None),
+            ('users-create', 'post', '/api/users/', {
+                'email': 'benchmark@example.com',
+                'username': 'benchmark',
+                'first_name': 'Имя',
+                'last_name': 'Фамилия',
+                'password': PASSWORD
+            }),
+            ('auth-token-login', 'post', '/api/auth/token/login/', {
+                'email': user.email, 'password': PASSWORD
+            }),
+            ('auth-token-logout', 'post', '/api/auth/token/logout/', None),
+        ]
+        for size in range(len(filters) + 1):
+            for names in combinations(filters, size):
+                query = '&'.join(filters[name] for name in names)
+                cases.append((
+                    'recipes-list' + ''.join(f'-{name}' for name in names),
+                    'get',
+                    f'/api/recipes/?{query}',
+                    None
+                ))
+        if tag:
+            cases.append(('tags-detail', 'get', f'/api/tags/{tag.pk}/', None))
+        if ingredient:
+            cases.append((
+                'ingredients-detail', 'get',
+                f'/api/ingredients/{ingredient.pk}/', None
+            ))
+        if recipe:
+            cases += [
+                ('recipes-detail', 'get', f'/api/recipes/{recipe.pk}/', None),
+                ('users-detail', 'get', f'/api/users/{recipe.author_id}/',
+                 None),
+                ('recipes-update', 'patch', f'/api/recipes/{own.pk}/',
+                 payload),
+            ]
+            if own.author_id == user.pk:
+                cases.append((
+                    'recipes-delete', 'delete', f'/api/recipes/{own.pk}/',
+                    None
+                ))
+        cases += self.link_cases(
+            'users-subscribe', '/api/users/{}/subscribe/',
+            '/api/users/subscribe/', authors, followed
+        )
+        cases += self.link_cases(
+            'recipes-favorite', '/api/recipes/{}/favorite/',
+            '/api/recipes/favorite/', favourites, favourited
+        )
+        cases += self.link_cases(
+            'recipes-shopping-cart', '/api/recipes/{}/shopping_cart/',
+            '/api/recipes/shopping_cart/', carts, carted
+        )
+        return cases
+
+    def missing(self, model, user):
+        return list(Recipe.objects.exclude(
+            pk__in=model.objects.filter(user=user).values('recipe')
+        ).order_by('id').values_list('id', flat=True)[:BULK_SIZE])
+
+    def present(self, model, user):
+        return list(model.objects.filter(user=user).order_by(
+            'recipe_id'
+        ).values_list('recipe_id', flat=True)[:BULK_SIZE])
+
+    def link_cases(self, name, url, bulk_url, missing, present):
+        """Сценарии добавления и удаления по одному и пачкой"""
+        cases = []
+        if missing:
+            cases += [
+                (name, 'post', url.format(missing[0]), None),
+                (f'{name}-bulk', 'post', bulk_url, {'ids': missing}),
+            ]
+        if present:
+            cases += [
+                (f'{name}-delete', 'delete', url.format(present[0]), None),
+                (f'{name}-bulk-delete', 'delete', bulk_url,
+                 {'ids': present}),
+            ]
+        return cases
+
+    def request(self, client, method, url, data):
+        # Изменения каждого запроса откатываются, база остается прежней.
+        with transaction.atomic():
+            started = time.perf_counter()
+            response = getattr(client, method)(url, data, format='json')
+            content = (
+                b''.join(response.streaming_content)
+                if response.streaming else response.content
+            )
+            elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+        return response.status_code, elapsed * 1000, len(content)
+
+    def measure(self, client, method, url, data, options):
+        for _ in range(options['warmup']):
+            self.request(client, method, url, data)
+        timings = []
+        for _ in range(options['iterations']):
+            if options['cold']:
+                cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                status, elapsed, size = self.request(
+                    client, method, url, data
+                )
+            timings.append(elapsed)
+        return {
+            'status': status,
+            'p50_ms': round(percentile(timings, 0.5), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            # Открытие и откат транзакции бенчмарка не учитываются.
+            'queries': sum(
+                not query['sql'].startswith(TRANSACTION_STATEMENTS)
+                for query in queries.captured_queries
+            ),
+            'bytes': size
+        }
+
+    def get_meta(self, options):
+        return {
+            'vendor': connection.vendor,
+            'iterations': options['iterations'],
+            'cold': options['cold'],
+            'users': User.objects.count(),
+            'recipes': Recipe.objects.count(),
+            'follows': Follow.objects.count(),
+        }
+
+    def load_baseline(self, meta, options):
+        with open(options['baseline'], encoding='utf-8') as file:
+            baseline = json.load(file)
+        # Замеры на другой базе или с другими ключами несравнимы.
+        differences = [
+            f'{key}: {baseline["meta"].get(key)} -> {value}'
+            for key, value in meta.items()
+            if baseline['meta'].get(key) != value
+        ]
+        if differences and not options['force']:
+            raise CommandError(
+                'Условия замеров отличаются от эталона ('
+                + ', '.join(differences)
+                + '), сравнение без --force невозможно'
+            )
+        for difference in differences:
+            self.stdout.write(self.style.WARNING(difference))
+        return baseline['results']
+
+    def compare(self, results, baseline, options):
+        regressions = []
+        for name, result in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            if result['queries'] > base['queries']:
+                regressions.append(
+                    f'{name}: запросов {base["queries"]} -> '
+                    f'{result["queries"]}'
+                )
+            limit = max(
+                base['p95_ms'] * (1 + options['threshold']),
+                base['p95_ms'] + options['min_delta']
+            )
+            if result['p95_ms'] > limit:
+                regressions.append(
+                    f'{name}: p95 {base["p95_ms"]} -> {result["p95_ms"]} мс'
+                )
+            if result['status'] != base['status']:
+                regressions.append(
+                    f'{name}: статус {base["status"]} -> {result["status"]}'
+                )
+        return regressions
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('Нужна хотя бы одна итерация')
+        user = self.get_user(options['user'])
+        meta = self.get_meta(options)
+        baseline = (
+            self.load_baseline(meta, options) if options['baseline'] else None
+        )
+        results = {}
+        # Пароль для входа по токену задается только на время замеров.
+        with transaction.atomic():
+            user.set_password(PASSWORD)
+            user.save(update_fields=('password',))
+            token, _ = Token.objects.get_or_create(user=user)
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+            for name, method, url, data in self.get_cases(user):
+                if options['only'] and options['only'] not in name:
+                    continue
+                results[name] = result = self.measure(
+                    client, method, url, data, options
+                )
+                self.stdout.write(
+                    f'{name:<55} {result["status"]} '
+                    f'p50={result["p50_ms"]:>8.2f} мс '
+                    f'p95={result["p95_ms"]:>8.2f} мс '
+                    f'запросов={result["queries"]:>3} '
+                    f'байт={result["bytes"]}'
+                )
+            transaction.set_rollback(True)
+        report = {'meta': meta, 'results': results}
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+        if baseline is None:
+            return
+        regressions = self.compare(results, baseline, options)
+        for regression in regressions:
+            self.stdout.write(self.style.ERROR(regression))
+        if regressions:
+            raise CommandError(f'Регрессий: {len(regressions)}')
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
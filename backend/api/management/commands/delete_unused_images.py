@@ -0,0 +1,48 @@
+import os
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from recipes.images import (delete_unused_images, referenced_images,
+                            unused_images)
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Удаляет картинки, на которые не ссылается ни один рецепт'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать файлы, которые будут удалены'
+        )
+        parser.add_argument(
+            '--grace',
+            type=int,
+            default=60,
+            help='Не трогать файлы моложе указанного числа минут'
+        )
+
+    def walk(self, storage, directory):
+        directories, files = storage.listdir(directory)
+        for name in files:
+            yield os.path.join(directory, name)
+        for name in directories:
+            yield from self.walk(storage, os.path.join(directory, name))
+
+    def handle(self, *args, **options):
+        field = Recipe._meta.get_field('image')
+        if not field.storage.exists(field.upload_to):
+            return
+        names = list(self.walk(field.storage, field.upload_to))
+        modified_before = timezone.now() - timedelta(minutes=options['grace'])
+        collect = unused_images if options['dry_run'] else delete_unused_images
+        unused = collect(names, modified_before, referenced_images())
+        for name in sorted(unused):
+            self.stdout.write(name)
+        action = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} файлов: {len(unused)} из {len(names)}'
+        ))
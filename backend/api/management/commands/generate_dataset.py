@@ -0,0 +1,204 @@
+import random
+import time
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import transaction
+
+from api.cache import bump_version
+from api.indexes import recipe_index
+from recipes.models import (Favourites, Ingredient, IngredientInRecipe,
+                            Recipe, ShoppingList, Tag)
+from users.models import Follow, User
+
+
+class ZipfSampler:
+    """Выбор элементов с популярностью по закону Ципфа"""
+
+    def __init__(self, items, exponent, rng):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.cum_weights = list(accumulate(
+            1 / rank ** exponent for rank in range(1, len(self.items) + 1)
+        ))
+        self.rng = rng
+
+    def sample(self, k, exclude=None):
+        k = min(k, len(self.items) - (exclude is not None))
+        chosen = set()
+        for _ in range(20):
+            if len(chosen) >= k:
+                break
+            chosen.update(self.rng.choices(
+                self.items, cum_weights=self.cum_weights, k=k - len(chosen)
+            ))
+            chosen.discard(exclude)
+        return list(islice(chosen, k))
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими пользователями и рецептами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--ingredients',
+            type=int,
+            default=8,
+            help='Среднее количество ингредиентов в рецепте'
+        )
+        parser.add_argument(
+            '--follows',
+            type=int,
+            default=10,
+            help='Среднее количество подписок пользователя'
+        )
+        parser.add_argument(
+            '--favourites',
+            type=int,
+            default=20,
+            help='Среднее количество рецептов в избранном'
+        )
+        parser.add_argument(
+            '--cart',
+            type=int,
+            default=5,
+            help='Среднее количество рецептов в списке покупок'
+        )
+        parser.add_argument(
+            '--zipf',
+            type=float,
+            default=1.1,
+            help='Показатель степени распределения популярности'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--prefix',
+            default='load',
+            help='Префикс имен создаваемых пользователей'
+        )
+
+    def insert(self, model, objects, fetch_ids=False):
+        """Пачками вставляет объекты, по запросу возвращает id новых строк"""
+        last_id = model.objects.order_by('-id').values_list(
+            'id', flat=True
+        ).first() or 0
+        table = model._meta.db_table
+        inserted, started = 0, time.monotonic()
+        with transaction.atomic():
+            while True:
+                batch = list(islice(objects, self.batch_size))
+                if not batch:
+                    break
+                model.objects.bulk_create(batch, ignore_conflicts=True)
+                inserted += len(batch)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'{table}: {inserted} строк, '
+                    f'{inserted / max(elapsed, 1e-6):.0f} строк/с'
+                )
+        if not fetch_ids:
+            return None
+        # SQLite не возвращает id из bulk_create, поэтому перечитываем.
+        return list(model.objects.filter(id__gt=last_id).order_by(
+            'id'
+        ).values_list('id', flat=True))
+
+    def count(self, average):
+        return self.rng.randint(0, 2 * average)
+
+    def users(self, total, prefix):
+        start = User.objects.filter(username__startswith=prefix).count()
+        password = make_password(prefix)
+        for number in range(start, start + total):
+            yield User(
+                username=f'{prefix}{number}',
+                email=f'{prefix}{number}@example.com',
+                first_name='Имя',
+                last_name='Фамилия',
+                password=password
+            )
+
+    def recipes(self, total, authors):
+        for number in range(total):
+            author_id, = authors.sample(1)
+            yield Recipe(
+                author_id=author_id,
+                name=f'Рецепт {number}',
+                text=f'Описание рецепта {number}',
+                cooking_time=self.rng.randint(5, 180)
+            )
+
+    def recipe_ingredients(self, recipe_ids, ingredients, average):
+        for recipe_id in recipe_ids:
+            size = max(1, round(self.rng.gauss(average, average / 3)))
+            for ingredient_id in ingredients.sample(size):
+                yield IngredientInRecipe(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=self.rng.randint(1, 500)
+                )
+
+    def recipe_tags(self, recipe_ids, tag_ids):
+        through = Recipe.tags.through
+        for recipe_id in recipe_ids:
+            for tag_id in self.rng.sample(
+                tag_ids, self.rng.randint(1, len(tag_ids))
+            ):
+                yield through(recipe_id=recipe_id, tag_id=tag_id)
+
+    def links(self, model, field, user_ids, sampler, average, exclude=False):
+        for user_id in user_ids:
+            for target_id in sampler.sample(
+                self.count(average), exclude=user_id if exclude else None
+            ):
+                yield model(user_id=user_id, **{field: target_id})
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        ingredient_ids = sorted(
+            Ingredient.objects.values_list('id', flat=True)
+        )
+        tag_ids = sorted(Tag.objects.values_list('id', flat=True))
+        if not ingredient_ids or not tag_ids:
+            raise CommandError(
+                'Сначала загрузите ингредиенты и теги: load_to_database'
+            )
+        started = time.monotonic()
+        exponent = options['zipf']
+        user_ids = self.insert(
+            User, self.users(options['users'], options['prefix']),
+            fetch_ids=True
+        )
+        authors = ZipfSampler(user_ids, exponent, self.rng)
+        recipe_ids = self.insert(
+            Recipe, self.recipes(options['recipes'], authors), fetch_ids=True
+        )
+        self.insert(IngredientInRecipe, self.recipe_ingredients(
+            recipe_ids,
+            ZipfSampler(ingredient_ids, exponent, self.rng),
+            options['ingredients']
+        ))
+        self.insert(Recipe.tags.through, self.recipe_tags(recipe_ids, tag_ids))
+        self.insert(Follow, self.links(
+            Follow, 'author_id', user_ids, authors, options['follows'],
+            exclude=True
+        ))
+        popular = ZipfSampler(recipe_ids, exponent, self.rng)
+        self.insert(Favourites, self.links(
+            Favourites, 'recipe_id', user_ids, popular, options['favourites']
+        ))
+        self.insert(ShoppingList, self.links(
+            ShoppingList, 'recipe_id', user_ids, popular, options['cart']
+        ))
+        call_command('recount_counters', stdout=self.stdout)
+        call_command('rebuild_shopping_carts', stdout=self.stdout)
+        bump_version('count', Recipe._meta.label_lower)
+        recipe_index.reset()
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные сгенерированы за {time.monotonic() - started:.1f} с'
+        ))
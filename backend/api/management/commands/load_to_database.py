@@ -1,24 +1,176 @@
 import csv
+import io
+import json
+import os
+import re
+import time
+from itertools import islice
 
 from django.conf import settings
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
 
-from recipes.models import Ingredient
+from api.cache import bump_version
+from recipes.models import Ingredient, Tag
 
-DICT = {
-    Ingredient: 'ingredients.csv'
-}
+DATA_DIR = os.path.join(settings.BASE_DIR, 'recipes', 'data')
+CHUNK_SIZE = 1 << 16
+SEPARATORS = re.compile(r'[\s,]*')
+VALUE_END = re.compile(r'[\s,\]]')
+
+
+def read_json_array(file):
+    """Потоково разбирает JSON-массив, не загружая файл в память целиком"""
+    decoder = json.JSONDecoder()
+    buffer, chunk = '', ' '
+    while chunk and not buffer:
+        chunk = file.read(CHUNK_SIZE)
+        buffer = chunk.lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('JSON-файл должен содержать массив')
+    buffer, position, exhausted = buffer[1:], 0, False
+    while True:
+        position = SEPARATORS.match(buffer, position).end()
+        if buffer.startswith(']', position):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if exhausted:
+                raise
+            end = None
+        # Значение могло быть разрезано границей блока: объект тогда
+        # не разбирается, а от числа разбирается только начало.
+        if not exhausted and (end is None or not VALUE_END.match(buffer, end)):
+            chunk = file.read(CHUNK_SIZE)
+            buffer = buffer[position:] + chunk
+            position, exhausted = 0, not chunk
+            continue
+        position = end
+        yield item
 
 
 class Command(BaseCommand):
+    help = 'Загружает ингредиенты и теги, повторный запуск ничего не ломает'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default=os.path.join(DATA_DIR, 'ingredients.csv'),
+            help='Файл с ингредиентами в формате CSV, JSON или JSON Lines'
+        )
+        parser.add_argument(
+            '--tags',
+            default=os.path.join(DATA_DIR, 'tags.json'),
+            help='Файл с тегами в формате CSV, JSON или JSON Lines'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Количество строк в одной пачке'
+        )
+
+    def read(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in ('.csv', '.json', '.jsonl'):
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        with open(path, encoding='utf-8') as file:
+            if extension == '.csv':
+                yield from csv.DictReader(file)
+            elif extension == '.jsonl':
+                yield from (json.loads(line) for line in file if line.strip())
+            else:
+                yield from read_json_array(file)
+
+    def read_ingredients(self, path):
+        for row in self.read(path):
+            name = row['name'].strip()
+            if name:
+                yield name, row['measurement_unit'].strip()
+
+    def copy_chunk(self, cursor, chunk):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(chunk)
+        buffer.seek(0)
+        cursor.copy_expert(
+            'COPY ingredient_staging (name, measurement_unit) '
+            'FROM STDIN WITH (FORMAT csv)',
+            buffer
+        )
+
+    def insert_chunk(self, cursor, chunk):
+        Ingredient.objects.bulk_create(
+            (
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in chunk
+            ),
+            ignore_conflicts=True
+        )
+
+    def load_ingredients(self, path, batch_size):
+        table = Ingredient._meta.db_table
+        staging = connection.vendor == 'postgresql'
+        load_chunk = self.copy_chunk if staging else self.insert_chunk
+        before = Ingredient.objects.count()
+        rows = self.read_ingredients(path)
+        processed, started = 0, time.monotonic()
+        with transaction.atomic(), connection.cursor() as cursor:
+            if staging:
+                cursor.execute(
+                    'CREATE TEMPORARY TABLE ingredient_staging '
+                    '(name text, measurement_unit text) ON COMMIT DROP'
+                )
+            while True:
+                chunk = list(islice(rows, batch_size))
+                if not chunk:
+                    break
+                load_chunk(cursor, chunk)
+                processed += len(chunk)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'{table}: {processed} строк, '
+                    f'{processed / max(elapsed, 1e-6):.0f} строк/с'
+                )
+            if staging:
+                cursor.execute(
+                    f'INSERT INTO {table} (name, measurement_unit) '
+                    'SELECT DISTINCT name, measurement_unit '
+                    'FROM ingredient_staging '
+                    'ON CONFLICT (name, measurement_unit) DO NOTHING'
+                )
+        created = Ingredient.objects.count() - before
+        if created:
+            bump_version(Ingredient._meta.label_lower)
+        return processed, created
 
-    def handle(self, *args, **kwargs):
-        for model, base in DICT.items():
-            with open(
-                f'{settings.BASE_DIR}/recipes/data/{base}',
-                'r', encoding='utf-8'
-            ) as csv_file:
-                reader = csv.DictReader(csv_file)
-                model.objects.bulk_create(model(**data) for data in reader)
+    def load_tags(self, path):
+        # Существующие теги не трогаем: правки из админки сохраняются,
+        # а версия тегов и ETag не сбрасываются при каждом деплое.
+        created = 0
+        with transaction.atomic():
+            for row in self.read(path):
+                _, is_new = Tag.objects.get_or_create(
+                    slug=row['slug'].strip(),
+                    defaults={
+                        'name': row['name'].strip(),
+                        'color': row['color'].strip()
+                    }
+                )
+                created += is_new
+        return created
 
-        self.stdout.write(self.style.SUCCESS('Данные успешно загружены'))
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        processed, created = self.load_ingredients(
+            options['path'], options['batch_size']
+        )
+        self.stdout.write(
+            f'Ингредиенты: прочитано {processed}, добавлено {created}'
+        )
+        created = self.load_tags(options['tags'])
+        self.stdout.write(f'Теги: добавлено {created}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные успешно загружены за '
+            f'{time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from recipes.images import process_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Обрабатывает картинки рецептов, оставшиеся без уменьшенных копий'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать рецепты, картинки которых не обработаны'
+        )
+        parser.add_argument(
+            '--grace',
+            type=int,
+            default=10,
+            help='Не трогать картинки моложе указанного числа минут'
+        )
+
+    def pending(self, modified_before):
+        # Очередь обработки живет в памяти воркера и теряется при его
+        # перезапуске, такие рецепты остаются с пустым image_variants.
+        storage = Recipe._meta.get_field('image').storage
+        recipes = Recipe.objects.filter(image_variants={}).exclude(
+            image=''
+        ).values_list('id', 'image')
+        for recipe_id, name in recipes.iterator():
+            try:
+                if storage.get_modified_time(name) < modified_before:
+                    yield recipe_id, name
+            except FileNotFoundError:
+                self.stderr.write(f'Рецепт {recipe_id}: нет файла {name}')
+
+    def handle(self, *args, **options):
+        modified_before = timezone.now() - timedelta(minutes=options['grace'])
+        pending = list(self.pending(modified_before))
+        for recipe_id, name in pending:
+            self.stdout.write(f'Рецепт {recipe_id}: {name}')
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Нужно обработать картинок: {len(pending)}'
+            ))
+            return
+        for recipe_id, name in pending:
+            process_image(recipe_id, name)
+        processed = Recipe.objects.filter(
+            id__in=[recipe_id for recipe_id, _ in pending]
+        ).exclude(image_variants={}).count()
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {processed} из {len(pending)}'
+        ))
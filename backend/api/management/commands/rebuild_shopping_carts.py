@@ -0,0 +1,48 @@
+from django.core.management import BaseCommand
+
+from recipes.models import ShoppingCartIngredient
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает суммарные списки покупок пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сравнить с пересчитанными суммами'
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            ShoppingCartIngredient.objects.rebuild()
+            self.stdout.write(self.style.SUCCESS('Списки покупок пересчитаны'))
+            return
+        expected = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total
+            in ShoppingCartIngredient.objects.expected().iterator()
+        }
+        actual = dict(
+            ((user_id, ingredient_id), amount)
+            for user_id, ingredient_id, amount
+            in ShoppingCartIngredient.objects.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            ).iterator()
+        )
+        mismatches = [
+            (key, actual.get(key), expected.get(key))
+            for key in expected.keys() | actual.keys()
+            if actual.get(key) != expected.get(key)
+        ]
+        for (user_id, ingredient_id), found, total in sorted(mismatches):
+            self.stdout.write(
+                f'user={user_id} ingredient={ingredient_id}: '
+                f'{found} вместо {total}'
+            )
+        if mismatches:
+            self.stdout.write(self.style.ERROR(
+                f'Расхождений: {len(mismatches)}'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
@@ -0,0 +1,34 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favourites, Recipe, ShoppingList
+from users.models import Follow, User
+
+
+def count(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).values(
+            field
+        ).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики рецептов, избранного и подписчиков'
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.update(
+            favourites_count=count(Favourites, 'recipe'),
+            shopping_list_count=count(ShoppingList, 'recipe')
+        )
+        users = User.objects.update(
+            recipes_count=count(Recipe, 'author'),
+            followers_count=count(Follow, 'author')
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Счетчики пересчитаны: рецептов {recipes}, '
+            f'пользователей {users}'
+        ))
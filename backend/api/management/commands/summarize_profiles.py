@@ -0,0 +1,74 @@
+import glob
+import io
+import json
+import os
+import pstats
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Сводка по сохраненным профилям запросов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=settings.PROFILING_DIR)
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=20,
+            help='Количество самых затратных функций'
+        )
+        parser.add_argument(
+            '--sort',
+            default='cumulative',
+            help='Ключ сортировки pstats: cumulative, tottime, ncalls'
+        )
+        parser.add_argument(
+            '--view',
+            help='Только профили этого представления'
+        )
+        parser.add_argument('--action', help='Только профили этого действия')
+
+    def load(self, options):
+        for path in sorted(glob.glob(os.path.join(options['dir'], '*.json'))):
+            profile = os.path.splitext(path)[0] + '.prof'
+            if not os.path.exists(profile):
+                continue
+            with open(path, encoding='utf-8') as file:
+                meta = json.load(file)
+            if options['view'] and meta['view'] != options['view']:
+                continue
+            if options['action'] and meta['action'] != options['action']:
+                continue
+            yield profile, meta
+
+    def handle(self, *args, **options):
+        profiles = list(self.load(options))
+        if not profiles:
+            raise CommandError(f'Нет профилей в {options["dir"]}')
+        groups = defaultdict(list)
+        for _, meta in profiles:
+            groups[(meta['view'], meta['action'])].append(meta)
+        for (view, action), metas in sorted(groups.items()):
+            durations = sorted(meta['duration_ms'] for meta in metas)
+            queries = [
+                meta['queries'] for meta in metas
+                if meta['queries'] is not None
+            ]
+            self.stdout.write(
+                f'{view or "unresolved"}.{action or "-"}: '
+                f'профилей {len(metas)}, '
+                f'медиана {durations[len(durations) // 2]:.1f} мс, '
+                f'максимум {durations[-1]:.1f} мс, '
+                f'запросов в среднем '
+                f'{sum(queries) / len(queries) if queries else 0:.1f}'
+            )
+        report = io.StringIO()
+        stats = pstats.Stats(profiles[0][0], stream=report)
+        for profile, _ in profiles[1:]:
+            stats.add(profile)
+        stats.strip_dirs().sort_stats(options['sort'])
+        stats.print_stats(options['top'])
+        self.stdout.write(report.getvalue())
@@ -0,0 +1,75 @@
+import hmac
+import os
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+REQUEST_LATENCY = Histogram(
+    'foodgram_request_duration_seconds',
+    'Время обработки запроса',
+    ('view', 'action', 'method'),
+    buckets=(
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+    )
+)
+REQUESTS = Counter(
+    'foodgram_requests_total',
+    'Количество ответов по статусам',
+    ('view', 'action', 'method', 'status')
+)
+DB_QUERIES = Histogram(
+    'foodgram_db_queries',
+    'Количество SQL-запросов на один запрос',
+    ('view', 'action'),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+)
+DB_DURATION = Histogram(
+    'foodgram_db_duration_seconds',
+    'Время SQL-запросов на один запрос',
+    ('view', 'action'),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+CACHE_HITS = Counter(
+    'foodgram_cache_hits_total',
+    'Попадания в кэш',
+    ('cache',)
+)
+CACHE_MISSES = Counter(
+    'foodgram_cache_misses_total',
+    'Промахи кэша',
+    ('cache',)
+)
+IN_PROGRESS = Gauge(
+    'foodgram_requests_in_progress',
+    'Запросы в обработке',
+    multiprocess_mode='livesum'
+)
+
+
+def record_cache(name, hits, misses):
+    if hits:
+        CACHE_HITS.labels(name).inc(hits)
+    if misses:
+        CACHE_MISSES.labels(name).inc(misses)
+
+
+def metrics(request):
+    """Метрики в текстовом формате Prometheus"""
+    # Без настроенного токена метрики закрыты: /api/ доступен снаружи.
+    token = settings.METRICS_TOKEN
+    if not token or not hmac.compare_digest(
+        request.headers.get('Authorization', ''), f'Bearer {token}'
+    ):
+        return HttpResponseForbidden()
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        # Каждый воркер gunicorn пишет свои файлы, собираем их все.
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(
+        generate_latest(registry), content_type=CONTENT_TYPE_LATEST
+    )
@@ -0,0 +1,221 @@
+import cProfile
+import glob
+import json
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.exceptions import AuthenticationFailed
+
+from api.authentication import CachedTokenAuthentication
+from api.metrics import (DB_DURATION, DB_QUERIES, IN_PROGRESS,
+                         REQUEST_LATENCY, REQUESTS)
+
+logger = logging.getLogger(__name__)
+
+STRINGS = re.compile(r"'(?:[^']|'')*'")
+NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDER_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+SPACES = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """Форма запроса без конкретных значений параметров"""
+    sql = NUMBERS.sub('?', STRINGS.sub('?', sql.replace('%s', '?')))
+    return SPACES.sub(' ', PLACEHOLDER_LISTS.sub('(...)', sql)).strip()
+
+
+class QueryStats:
+    """Статистика SQL-запросов одного HTTP-запроса"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+    def shapes(self):
+        # Нормализуем только различные строки SQL, а не каждый вызов.
+        shapes = Counter()
+        for sql, count in self.statements.items():
+            shapes[normalize_sql(sql)] += count
+        return shapes
+
+
+class QueryStatsMiddleware:
+    """Считает SQL-запросы, их время и повторы для каждого запроса"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = request.query_stats = QueryStats()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        total = (time.perf_counter() - started) * 1000
+        # Число и время запросов к БД показываем только своим.
+        user = getattr(request, 'user', None)
+        if settings.DEBUG or getattr(user, 'is_staff', False):
+            self.add_timing(response, stats, total)
+        self.report(request, stats, total)
+        return response
+
+    def add_timing(self, response, stats, total):
+        timing = (
+            f'db;dur={stats.duration * 1000:.1f};'
+            f'desc="{stats.count} queries", app;dur={total:.1f}'
+        )
+        if response.has_header('Server-Timing'):
+            timing = f'{response["Server-Timing"]}, {timing}'
+        response['Server-Timing'] = timing
+
+    def report(self, request, stats, total):
+        over_budget = (
+            stats.count > settings.SQL_QUERY_BUDGET
+            or stats.duration * 1000 > settings.SQL_TIME_BUDGET_MS
+        )
+        # Повторов больше порога не бывает при меньшем числе запросов.
+        threshold = settings.SQL_N_PLUS_ONE_THRESHOLD
+        if not over_budget and stats.count <= threshold:
+            return
+        shapes = stats.shapes()
+        repeated = [
+            (sql, count) for sql, count in shapes.most_common()
+            if count > threshold
+        ]
+        for sql, count in repeated:
+            logger.warning(
+                'Возможный N+1 в %s %s: %d одинаковых запросов %s',
+                request.method, request.path, count, sql[:500]
+            )
+        if over_budget:
+            logger.warning(
+                '%s %s: %d запросов, %.1f мс в БД, %.1f мс всего; '
+                'частые запросы: %s',
+                request.method, request.path, stats.count,
+                stats.duration * 1000, total,
+                '; '.join(
+                    f'{count}x {sql[:200]}'
+                    for sql, count in shapes.most_common(3)
+                )
+            )
+
+
+class MetricsMiddleware:
+    """Метрики Prometheus по представлениям и действиям"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.metrics_labels = ('unresolved', '')
+        started = time.perf_counter()
+        with IN_PROGRESS.track_inprogress():
+            response = self.get_response(request)
+        view, action = request.metrics_labels
+        REQUEST_LATENCY.labels(view, action, request.method).observe(
+            time.perf_counter() - started
+        )
+        REQUESTS.labels(
+            view, action, request.method, response.status_code
+        ).inc()
+        stats = getattr(request, 'query_stats', None)
+        if stats is not None:
+            DB_QUERIES.labels(view, action).observe(stats.count)
+            DB_DURATION.labels(view, action).observe(stats.duration)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'cls', view_func)
+        actions = getattr(view_func, 'actions', None) or {}
+        request.metrics_labels = (
+            view.__name__, actions.get(request.method.lower(), '')
+        )
+
+
+class ProfilingMiddleware:
+    """Профилирует случайную долю запросов и запросы с заголовком X-Profile"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if 'X-Profile' in request.headers:
+            if not self.is_staff(request):
+                return self.get_response(request)
+        elif random.random() >= settings.PROFILING_SAMPLE_RATE:
+            return self.get_response(request)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        duration = time.perf_counter() - started
+        self.save(request, response, profiler, duration)
+        return response
+
+    @staticmethod
+    def is_staff(request):
+        """Проверяет токен до включения профилировщика"""
+        try:
+            credentials = CachedTokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return False
+        return credentials is not None and credentials[0].is_staff
+
+    @staticmethod
+    def prune(directory, keep):
+        """Удаляет профили, кроме последних keep"""
+        # Имена начинаются со времени, поэтому сортировка хронологическая.
+        profiles = sorted(glob.glob(os.path.join(directory, '*.prof')))
+        for profile in profiles[:max(len(profiles) - keep, 0)]:
+            name = os.path.splitext(profile)[0]
+            for path in (profile, f'{name}.json'):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def save(self, request, response, profiler, duration):
+        view, action = getattr(request, 'metrics_labels', ('', ''))
+        stats = getattr(request, 'query_stats', None)
+        name = os.path.join(
+            settings.PROFILING_DIR,
+            f'{time.strftime("%Y%m%d-%H%M%S")}-{view or "unresolved"}'
+            f'-{action or "none"}-{uuid.uuid4().hex[:8]}'
+        )
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        self.prune(settings.PROFILING_DIR, settings.PROFILING_MAX_FILES - 1)
+        profiler.dump_stats(f'{name}.prof')
+        with open(f'{name}.json', 'w', encoding='utf-8') as file:
+            json.dump({
+                'method': request.method,
+                'path': request.path,
+                'view': view,
+                'action': action,
+                'filters': dict(request.GET.lists()),
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 2),
+                'queries': stats.count if stats else None,
+                'db_ms': round(stats.duration * 1000, 2) if stats else None
+            }, file, ensure_ascii=False)
@@ -1,6 +1,133 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+
+from api.cache import get_version
+from api.metrics import record_cache
 
 
 class CustomPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     page_size = 6
+
+
+class CachedCountPaginator(Paginator):
+    def __init__(self, object_list, per_page, count_getter, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_getter = count_getter
+
+    @cached_property
+    def count(self):
+        return self.count_getter()
+
+
+class CachedCountPagination(CustomPagination):
+    """Пагинация с кэшированием count по набору фильтров запроса"""
+    count_cache_timeout = settings.PAGINATION_COUNT_CACHE_TIMEOUT
+    estimate_threshold = settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD
+    user_query_params = ('is_favorited', 'is_in_shopping_cart')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        return super().paginate_queryset(queryset, request, view)
+
+    def django_paginator_class(self, queryset, page_size):
+        return CachedCountPaginator(
+            queryset, page_size, lambda: self.get_count(queryset)
+        )
+
+    def get_count_cache_key(self, queryset):
+        ignored = (
+            self.page_query_param, self.page_size_query_param, 'format'
+        )
+        params = sorted(
+            (key, sorted(values))
+            for key, values in self.request.query_params.lists()
+            if key not in ignored
+        )
+        label = queryset.model._meta.label_lower
+        versions = [get_version('count', label)]
+        user = self.request.user
+        if user.is_authenticated and any(
+            key in self.user_query_params for key, _ in params
+        ):
+            versions.append(get_version('count', label, user.pk))
+        signature = hashlib.md5(
+            json.dumps([params, versions]).encode()
+        ).hexdigest()
+        user_part = user.pk if len(versions) > 1 else ''
+        return f'count:{label}:{user_part}:{signature}'
+
+    def get_count(self, queryset):
+        key = self.get_count_cache_key(queryset)
+        count = cache.get(key)
+        record_cache('pagination_count', count is not None, count is None)
+        if count is None:
+            count = self.estimate_count(queryset)
+            if count is None:
+                count = queryset.count()
+            cache.set(key, count, self.count_cache_timeout)
+        return count
+
+    def estimate_count(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or not self.estimate_threshold:
+            return None
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        rows = int(plan[0]['Plan']['Plan Rows'])
+        if rows < self.estimate_threshold:
+            return None
+        return rows
+
+
+class RecipeCursorPagination(CursorPagination):
+    page_size_query_param = 'limit'
+    page_size = 6
+    ordering = ('-pub_date', 'id')
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', None),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+
+class RecipePagination(CachedCountPagination):
+    """Пагинация рецептов, ?pagination=cursor включает курсорный режим"""
+    mode_query_param = 'pagination'
+    search_query_param = 'search'
+    cursor_class = RecipeCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        params = request.query_params
+        # Курсор привязан к порядку по дате, а поиск сортирует по
+        # релевантности, поэтому с ?search= курсорный режим не включается.
+        if (params.get(self.mode_query_param) == 'cursor'
+                or self.cursor_class.cursor_query_param in params) and (
+                not params.get(self.search_query_param)):
+            self.cursor_paginator = self.cursor_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
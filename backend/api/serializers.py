@@ -1,8 +1,17 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Manager, prefetch_related_objects
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
-from recipes.models import Ingredient, IngredientInRecipe, Recipe, Tag
+from api.cache import get_versions, make_etag
+from api.fields import Base64ImageUploadField, ImageVariantsField
+from api.metrics import record_cache
+from recipes.images import schedule_image_processing
+from recipes.models import (Ingredient, IngredientInRecipe, Recipe,
+                            RecipeQuerySet, ShoppingCartIngredient, Tag)
 from users.models import Follow, User
 
 
@@ -15,9 +24,30 @@ def check_request(self, obj):
 
 class SubscribeMixin:
     def get_is_subscribed(self, obj: User):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         if check_request(self, obj):
             return check_request(
                 self, obj).user.follower.filter(author=obj).exists()
+        return False
+
+
+class RecipeFlagsMixin:
+    def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        if check_request(self, obj):
+            return check_request(
+                self, obj).user.favourites.filter(recipe_id=obj.id).exists()
+        return False
+
+    def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        if check_request(self, obj):
+            return check_request(
+                self, obj).user.shopping_list.filter(recipe_id=obj.id).exists()
+        return False
 
 
 class UsersCreateSerializer(UserCreateSerializer, SubscribeMixin):
@@ -56,8 +86,31 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit')
 
 
+class IngredientInRecipeListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        ingredients = super().to_internal_value(data)
+        ids = [ingredient['ingredient_id'] for ingredient in ingredients]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Ингредиенты не должны повторяться'
+            )
+        found = Ingredient.objects.in_bulk(ids)
+        unknown = [pk for pk in ids if pk not in found]
+        if unknown:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {", ".join(map(str, unknown))}'
+            )
+        return [
+            {
+                'ingredient': found[ingredient['ingredient_id']],
+                'amount': ingredient['amount']
+            }
+            for ingredient in ingredients
+        ]
+
+
 class IngredientInRecipeSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField(source='ingredient_id')
     name = serializers.CharField(source='ingredient.name', read_only=True)
     measurement_unit = serializers.CharField(
         source='ingredient.measurement_unit',
@@ -67,39 +120,96 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
     class Meta:
         model = IngredientInRecipe
         fields = ('id', 'name', 'amount', 'measurement_unit')
+        list_serializer_class = IngredientInRecipeListSerializer
+
 
+class RecipeListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        recipes = data.all() if isinstance(data, Manager) else data
+        return self.child.to_representations(list(recipes))
 
-class RecipeSerializer(serializers.ModelSerializer):
+
+class RecipeSerializer(RecipeFlagsMixin, serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     ingredients = serializers.SerializerMethodField()
     author = UsersSerializer(read_only=True)
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time'
+            'is_in_shopping_cart', 'name', 'image', 'image_variants', 'text',
+            'cooking_time'
         )
+        list_serializer_class = RecipeListSerializer
+
+    def to_representation(self, instance):
+        return self.to_representations([instance])[0]
+
+    def to_representations(self, recipes):
+        keys = self.get_fragment_keys(recipes)
+        fragments = cache.get_many(keys)
+        missing = {
+            key: recipe for recipe, key in zip(recipes, keys)
+            if key not in fragments
+        }
+        if missing:
+            prefetch_related_objects(
+                list(missing.values()), *RecipeQuerySet.details_lookups()
+            )
+            rendered = {
+                key: super(RecipeSerializer, self).to_representation(recipe)
+                for key, recipe in missing.items()
+            }
+            cache.set_many(rendered, settings.RECIPE_FRAGMENT_CACHE_TIMEOUT)
+            fragments.update(rendered)
+        record_cache(
+            'recipe_fragment', len(recipes) - len(missing), len(missing)
+        )
+        return [
+            self.add_user_fields(fragments[key], recipe)
+            for recipe, key in zip(recipes, keys)
+        ]
 
-    def get_ingredients(self, obj):
-        ingredients = IngredientInRecipe.objects.filter(recipe=obj)
-        return IngredientInRecipeSerializer(ingredients, many=True).data
-
-    def get_is_favorited(self, obj):
-        if check_request(self, obj):
-            return check_request(
-                self, obj).user.favourites.filter(recipe_id=obj.id).exists()
+    def get_fragment_keys(self, recipes):
+        request = self.context.get('request')
+        host = request.build_absolute_uri('/') if request else ''
+        names = [
+            (Tag._meta.label_lower,),
+            (Ingredient._meta.label_lower,)
+        ]
+        for recipe in recipes:
+            names.append((Recipe._meta.label_lower, recipe.pk))
+            names.append((User._meta.label_lower, recipe.author_id))
+        tags_version, ingredients_version, *versions = get_versions(*names)
+        return [
+            'recipe:{}:{}'.format(recipe.pk, make_etag(
+                host, tags_version, ingredients_version, *versions[
+                    position * 2:position * 2 + 2
+                ]
+            ))
+            for position, recipe in enumerate(recipes)
+        ]
+
+    def add_user_fields(self, data, recipe):
+        data['is_favorited'] = self.get_is_favorited(recipe)
+        data['is_in_shopping_cart'] = self.get_is_in_shopping_cart(recipe)
+        data['author']['is_subscribed'] = self.fields[
+            'author'
+        ].get_is_subscribed(recipe.author)
+        return data
 
-    def get_is_in_shopping_cart(self, obj):
-        if check_request(self, obj):
-            return check_request(
-                self, obj).user.shopping_list.filter(recipe_id=obj.id).exists()
+    def get_ingredients(self, obj):
+        return IngredientInRecipeSerializer(
+            obj.ingredients_in_recipe.all(), many=True
+        ).data
 
 
-class CreateRecipeSerializer(serializers.ModelSerializer):
-    image = Base64ImageField(use_url=True, max_length=None)
+class CreateRecipeSerializer(RecipeFlagsMixin, serializers.ModelSerializer):
+    image = Base64ImageUploadField(use_url=True, max_length=None)
     tags = serializers.PrimaryKeyRelatedField(
         queryset=Tag.objects.all(),
         many=True
@@ -111,27 +221,22 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
     )
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time')
-
-    def get_is_favorited(self, obj):
-        if check_request(self, obj):
-            return check_request(
-                self, obj).user.favourites.filter(recipe_id=obj.id).exists()
+                  'is_in_shopping_cart', 'name', 'image', 'image_variants',
+                  'text', 'cooking_time')
 
-    def get_is_in_shopping_cart(self, obj):
-        if check_request(self, obj):
-            return check_request(
-                self, obj).user.shopping_list.filter(recipe_id=obj.id).exists()
+    def to_representation(self, instance):
+        prefetch_related_objects([instance], *RecipeQuerySet.details_lookups())
+        return super().to_representation(instance)
 
     def create_ingredients(self, ingredients, recipe):
         IngredientInRecipe.objects.bulk_create([
             IngredientInRecipe(
-                ingredient=ingredient['id'],
+                ingredient=ingredient['ingredient'],
                 recipe=recipe,
                 amount=ingredient['amount']
             ) for ingredient in ingredients
@@ -141,18 +246,11 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
         ingredients = data.get('ingredients_in_recipe')
         if not ingredients:
             raise serializers.ValidationError('Добавьте ингредиенты в рецепт')
-        ingredients_list = []
         for ingredient in ingredients:
-            amount = ingredient['amount']
-            if amount <= 0:
+            if ingredient['amount'] <= 0:
                 raise serializers.ValidationError(
                     'Количество должно быть больше 0'
                 )
-            if ingredient in ingredients_list:
-                raise serializers.ValidationError(
-                    'Ингредиенты не должны повторяться'
-                )
-            ingredients_list.append(ingredient)
         tags = data['tags']
         if not tags:
             raise serializers.ValidationError('Добавьте тег')
@@ -162,32 +260,74 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
             )
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients_in_recipe')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
         self.create_ingredients(ingredients, recipe)
         recipe.tags.set(tags)
+        schedule_image_processing(recipe)
         return recipe
 
+    def update_ingredients(self, ingredients, recipe):
+        rows = {
+            row.ingredient_id: row
+            for row in IngredientInRecipe.objects.select_for_update().filter(
+                recipe=recipe
+            )
+        }
+        old_amounts = {
+            ingredient_id: row.amount for ingredient_id, row in rows.items()
+        }
+        amounts = {
+            ingredient['ingredient'].pk: ingredient['amount']
+            for ingredient in ingredients
+        }
+        IngredientInRecipe.objects.filter(
+            recipe=recipe, ingredient_id__in=rows.keys() - amounts.keys()
+        ).delete()
+        changed = []
+        for ingredient_id, amount in amounts.items():
+            row = rows.get(ingredient_id)
+            if row is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        IngredientInRecipe.objects.bulk_update(changed, ('amount',))
+        self.create_ingredients(
+            [
+                ingredient for ingredient in ingredients
+                if ingredient['ingredient'].pk not in rows
+            ],
+            recipe
+        )
+        ShoppingCartIngredient.objects.change_recipe(
+            recipe, old_amounts, amounts
+        )
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        IngredientInRecipe.objects.filter(recipe=instance).delete()
+        # Добавление в список покупок ждет конца правки ингредиентов.
+        Recipe.objects.filter(pk=instance.pk).lock()
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients_in_recipe')
         instance.tags.set(tags)
-        self.create_ingredients(
-            ingredients=ingredients,
-            recipe=instance
+        self.update_ingredients(ingredients, instance)
+        recipe = super().update(
+            instance=instance, validated_data=validated_data
         )
-        return super().update(instance=instance, validated_data=validated_data)
+        if 'image' in validated_data:
+            schedule_image_processing(recipe)
+        return recipe
 
 
 class RecipeSubscribesSerializer(serializers.ModelSerializer):
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
         read_only_fields = ('id', 'name', 'image', 'cooking_time')
 
 
@@ -199,10 +339,7 @@ class FollowSerializer(UserSerializer):
     last_name = serializers.ReadOnlyField(source='author.last_name')
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.ReadOnlyField(source='author.recipes.count')
-    is_subscribed = serializers.SerializerMethodField()
-    recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.ReadOnlyField(source='author.recipes.count')
+    recipes_count = serializers.ReadOnlyField(source='author.recipes_count')
 
     class Meta:
         model = Follow
@@ -210,23 +347,49 @@ class FollowSerializer(UserSerializer):
                   'is_subscribed', 'recipes', 'recipes_count')
 
     def get_is_subscribed(self, obj):
-        return Follow.objects.filter(user=obj.user, author=obj.author).exists()
+        return True
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        queryset = Recipe.objects.filter(author=obj.author)
-        if limit:
-            queryset = queryset[:int(limit)]
-        return RecipeSubscribesSerializer(queryset, many=True).data
+        recipes = self.context.get('recipes')
+        if recipes is not None:
+            queryset = recipes.get(obj.author_id, [])
+        else:
+            queryset = Recipe.objects.filter(author=obj.author)[
+                :self.context.get('recipes_limit')
+            ]
+        return RecipeSubscribesSerializer(
+            queryset, many=True, context=self.context
+        ).data
 
 
 class FavouriteSerializer(serializers.ModelSerializer):
     name = serializers.ReadOnlyField(source='recipe.name')
     image = Base64ImageField(source='recipe.image')
+    image_variants = ImageVariantsField(source='recipe.image_variants')
     cooking_time = serializers.ReadOnlyField(source='recipe.cooking_time')
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
         read_only_fields = ('id', 'name', 'image', 'cooking_time')
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_MAX_IDS
+    )
+
+
+class WhatToCookSerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_MAX_IDS
+    )
+    mode = serializers.ChoiceField(('all', 'overlap'), default='overlap')
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+    limit = serializers.IntegerField(
+        min_value=1, max_value=settings.WHAT_TO_COOK_MAX_LIMIT, default=20
+    )
@@ -0,0 +1,123 @@
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.authentication import token_cache
+from api.cache import bump_version_on_commit
+from api.indexes import recipe_index
+from recipes.models import (Favourites, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCartIngredient, ShoppingList, Tag)
+from users.models import Follow, User
+
+
+def user_recipes_invalidate(user_id):
+    bump_version_on_commit('count', Recipe._meta.label_lower, user_id)
+    bump_version_on_commit('viewer', user_id)
+
+
+def user_follows_invalidate(user_id):
+    bump_version_on_commit('viewer', user_id)
+
+
+def tokens_invalidate(user_id):
+    token_cache.delete_user(user_id)
+    for key in Token.objects.filter(user_id=user_id).values_list(
+        'key', flat=True
+    ):
+        bump_version_on_commit('token', key)
+
+
+def recipe_index_invalidate(recipe_id):
+    # Ингредиенты рецепта сохраняются пачкой в той же транзакции,
+    # поэтому индекс читает их только после коммита.
+    transaction.on_commit(lambda: recipe_index.record_change(recipe_id))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, update_fields, **kwargs):
+    # Правка названия или описания меняет результаты поиска.
+    if created or update_fields is None or {'name', 'text'} & update_fields:
+        bump_version_on_commit('count', Recipe._meta.label_lower)
+    bump_version_on_commit(Recipe._meta.label_lower, instance.pk)
+    if update_fields is None:
+        recipe_index_invalidate(instance.pk)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(sender, instance, **kwargs):
+    # Рецепт удаляется и в обход API: из админки или вместе с автором.
+    # Ингредиенты и списки покупок еще на месте, пока идет pre_delete.
+    ShoppingCartIngredient.objects.remove_recipe(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    bump_version_on_commit('count', Recipe._meta.label_lower)
+    bump_version_on_commit(Recipe._meta.label_lower, instance.pk)
+    recipe_index_invalidate(instance.pk)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    bump_version_on_commit('count', Recipe._meta.label_lower)
+    if reverse:
+        bump_version_on_commit(Tag._meta.label_lower)
+    else:
+        bump_version_on_commit(Recipe._meta.label_lower, instance.pk)
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+def recipe_ingredients_changed(sender, instance, **kwargs):
+    bump_version_on_commit(Recipe._meta.label_lower, instance.recipe_id)
+
+
+@receiver(post_save, sender=Favourites)
+@receiver(post_delete, sender=Favourites)
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_delete, sender=ShoppingList)
+def user_recipes_changed(sender, instance, **kwargs):
+    user_recipes_invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follow_changed(sender, instance, **kwargs):
+    user_follows_invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    tokens_invalidate(instance.pk)
+    bump_version_on_commit(User._meta.label_lower, instance.pk)
+
+
+@receiver(user_logged_out)
+def user_logged_out_handler(sender, user, **kwargs):
+    if user is not None:
+        tokens_invalidate(user.pk)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    token_cache.delete(instance.key)
+    bump_version_on_commit('token', instance.key)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredients_changed(sender, **kwargs):
+    bump_version_on_commit(Ingredient._meta.label_lower)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tags_changed(sender, **kwargs):
+    bump_version_on_commit(Tag._meta.label_lower)
@@ -0,0 +1,215 @@
+import base64
+import io
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib import admin
+from django.test import override_settings
+from PIL import Image
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from api.authentication import token_cache
+from recipes.admin import IngredientsInRecipeAdmin
+from recipes.models import (Ingredient, IngredientInRecipe,
+                            ShoppingCartIngredient, Tag)
+from users.models import User
+
+MEDIA_ROOT = tempfile.mkdtemp()
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+}
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=CACHES)
+class RecipeAPITestCase(APITestCase):
+    """Общие данные и помощники для тестов API рецептов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.buyer = (
+            User.objects.create_user(
+                username=name,
+                email=f'{name}@example.com',
+                password='password',
+                first_name='Имя',
+                last_name='Фамилия'
+            )
+            for name in ('author', 'buyer')
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(4)
+        )
+        cls.ingredients = list(Ingredient.objects.order_by('id'))
+        cls.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast'
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def client_for(self, user):
+        self.client.force_authenticate(user)
+        return self.client
+
+    def image(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), 'orange').save(buffer, 'PNG')
+        encoded = base64.b64encode(buffer.getvalue()).decode()
+        return f'data:image/png;base64,{encoded}'
+
+    def recipe_payload(self, amounts):
+        return {
+            'ingredients': [
+                {'id': self.ingredients[index].pk, 'amount': amount}
+                for index, amount in amounts.items()
+            ],
+            'tags': [self.tag.pk],
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': self.image()
+        }
+
+    def create_recipe(self, amounts):
+        response = self.client_for(self.author).post(
+            '/api/recipes/', self.recipe_payload(amounts), format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.json()['id']
+
+
+class TokenCacheTests(RecipeAPITestCase):
+    """Кэш токенов другого воркера не пропускает заблокированных"""
+
+    def test_deactivated_user_is_rejected_by_other_workers(self):
+        token = Token.objects.create(user=self.buyer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Локальный кэш другого воркера о блокировке не узнает.
+        with mock.patch.object(token_cache, 'delete_user'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.buyer.is_active = False
+                self.buyer.save()
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class RecipeETagTests(RecipeAPITestCase):
+    """ETag рецепта меняется после правки"""
+
+    def test_conditional_get_after_edit(self):
+        recipe = self.create_recipe({0: 100})
+        url = f'/api/recipes/{recipe}/'
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        payload = self.recipe_payload({0: 50, 1: 20})
+        del payload['image']
+        # Версии сдвигаются только после коммита транзакции запроса.
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(
+            {item['amount'] for item in response.json()['ingredients']},
+            {50, 20}
+        )
+
+
+class ShoppingCartIngredientTests(RecipeAPITestCase):
+    """Суммарный список покупок совпадает с пересчетом по рецептам"""
+
+    def assert_cart_consistent(self):
+        actual = set(ShoppingCartIngredient.objects.values_list(
+            'user_id', 'ingredient_id', 'amount'
+        ))
+        self.assertEqual(
+            actual, set(ShoppingCartIngredient.objects.expected())
+        )
+        return actual
+
+    def test_cart_follows_recipe_changes(self):
+        first = self.create_recipe({0: 100, 1: 20})
+        second = self.create_recipe({1: 5, 2: 1})
+        for user in (self.author, self.buyer):
+            response = self.client_for(user).post(
+                f'/api/recipes/{first}/shopping_cart/'
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client_for(self.buyer).post(
+            '/api/recipes/shopping_cart/', {'ids': [second]}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(
+            (self.buyer.pk, self.ingredients[1].pk, 25),
+            self.assert_cart_consistent()
+        )
+
+        response = self.client_for(self.author).patch(
+            f'/api/recipes/{first}/',
+            self.recipe_payload({1: 30, 3: 7}),
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        cart = self.assert_cart_consistent()
+        self.assertIn((self.buyer.pk, self.ingredients[1].pk, 35), cart)
+        self.assertNotIn(
+            self.ingredients[0].pk,
+            {ingredient_id for _, ingredient_id, _ in cart}
+        )
+
+        response = self.client_for(self.author).delete(
+            f'/api/recipes/{first}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assert_cart_consistent()
+
+        response = self.client_for(self.buyer).delete(
+            '/api/recipes/shopping_cart/', {'ids': [second]}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assert_cart_consistent()
+
+        response = self.client_for(self.author).delete(
+            f'/api/recipes/{first}/'
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.assert_cart_consistent(), set())
+
+    def test_cart_follows_admin_edits_and_account_deletion(self):
+        recipe = self.create_recipe({0: 100, 1: 20})
+        response = self.client_for(self.buyer).post(
+            f'/api/recipes/{recipe}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        model_admin = IngredientsInRecipeAdmin(IngredientInRecipe, admin.site)
+        row = IngredientInRecipe.objects.get(
+            recipe_id=recipe, ingredient=self.ingredients[1]
+        )
+        row.amount = 40
+        model_admin.save_model(None, row, None, True)
+        self.assertIn(
+            (self.buyer.pk, self.ingredients[1].pk, 40),
+            self.assert_cart_consistent()
+        )
+        model_admin.delete_queryset(None, IngredientInRecipe.objects.filter(
+            recipe_id=recipe, ingredient=self.ingredients[0]
+        ))
+        self.assert_cart_consistent()
+
+        response = self.client_for(self.author).delete(
+            '/api/users/me/', {'current_password': 'password'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.assert_cart_consistent(), set())
@@ -1,6 +1,7 @@
-from django.urls import include, path
+from django.urls import include, path, re_path
 from rest_framework.routers import DefaultRouter
 
+from .metrics import metrics
 from .views import IngredientViewSet, RecipeViewSet, TagsViewSet, UsersViewSet
 
 
@@ -15,4 +16,5 @@ router.register('users', UsersViewSet, 'users')
 urlpatterns = (
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
+    re_path(r'^metrics/?$', metrics, name='metrics'),
 )
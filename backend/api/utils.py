@@ -1,24 +1,91 @@
-from django.http import HttpResponse
-
-
-def create_shopping_list(ingredients, user):
-    filename = f'{user.username}_shopping_list.txt'
-    shopping_cart = {}
-    for ingredient in ingredients:
-        name = ingredient[0]
-        shopping_cart[name] = {
-            'amount': ingredient[2],
-            'measurement_unit': ingredient[1]
-        }
-        shopping_list = ['Список покупок\n']
-        for key, value in shopping_cart.items():
-            shopping_list.append(
-                f'{key}: {value["amount"]} {value["measurement_unit"]}\n'
-            )
-    response = HttpResponse(
-        shopping_list, content_type='text.txt; charset=utf-8'
+import csv
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework import serializers, status
+from rest_framework.response import Response
+
+from api.serializers import BulkIdsSerializer
+
+
+def get_int_param(request, name, min_value=0):
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    try:
+        return serializers.IntegerField(
+            min_value=min_value
+        ).run_validation(value)
+    except serializers.ValidationError as error:
+        raise serializers.ValidationError({name: error.detail})
+
+
+def get_bulk_ids(request):
+    serializer = BulkIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return list(dict.fromkeys(serializer.validated_data['ids']))
+
+
+def bulk_response(ids, groups):
+    return Response(
+        {'results': [
+            {
+                'id': pk,
+                'status': next(
+                    (name for name, pks in groups.items() if pk in pks),
+                    'not_found'
+                )
+            }
+            for pk in ids
+        ]},
+        status=status.HTTP_200_OK
+    )
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def shopping_list_txt(ingredients):
+    yield 'Список покупок\n'
+    for name, measurement_unit, amount in ingredients:
+        yield f'{name}: {amount} {measurement_unit}\n'
+
+
+def shopping_list_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Количество', 'Единица измерения'))
+    for name, measurement_unit, amount in ingredients:
+        yield writer.writerow((name, amount, measurement_unit))
+
+
+def shopping_list_json(ingredients):
+    yield '['
+    separator = ''
+    for name, measurement_unit, amount in ingredients:
+        yield separator + json.dumps({
+            'name': name,
+            'amount': amount,
+            'measurement_unit': measurement_unit
+        }, ensure_ascii=False)
+        separator = ','
+    yield ']'
+
+
+SHOPPING_LIST_FORMATS = {
+    'txt': (shopping_list_txt, 'text/plain; charset=utf-8'),
+    'csv': (shopping_list_csv, 'text/csv; charset=utf-8'),
+    'json': (shopping_list_json, 'application/json'),
+}
+
+
+def create_shopping_list(ingredients, user, file_format='txt'):
+    generator, content_type = SHOPPING_LIST_FORMATS[file_format]
+    response = StreamingHttpResponse(
+        generator(ingredients), content_type=content_type
     )
     response['Content-Disposition'] = (
-        f'attachment; filename={filename}.txt'
+        f'attachment; filename={user.username}_shopping_list.{file_format}'
     )
     return response
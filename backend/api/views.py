@@ -1,48 +1,168 @@
-from django.db.models import Sum
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import (AllowAny, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
+from api.cache import get_version, make_etag
 from api.filters import IngredientFilter, RecipeFilter
+from api.indexes import ingredient_index, recipe_index
+from api.paginators import RecipePagination
 from api.permissions import IsOwnerOrReadOnly
+from api.renderers import CSVRenderer, PlainTextRenderer
 from api.serializers import (CreateRecipeSerializer, FavouriteSerializer,
                              FollowSerializer, IngredientSerializer,
-                             RecipeSerializer, TagSerializer, UsersSerializer)
-from api.utils import create_shopping_list
-from recipes.models import (Favourites, Ingredient, IngredientInRecipe, Recipe,
-                            ShoppingList, Tag)
+                             RecipeSerializer, TagSerializer, UsersSerializer,
+                             WhatToCookSerializer)
+from api.signals import user_follows_invalidate, user_recipes_invalidate
+from api.utils import (bulk_response, create_shopping_list, get_bulk_ids,
+                       get_int_param)
+from recipes.models import (Favourites, Ingredient, Recipe,
+                            ShoppingCartIngredient, ShoppingList, Tag)
 from users.models import Follow, User
 
 
+RECIPE_COUNTERS = {
+    Favourites: 'favourites_count',
+    ShoppingList: 'shopping_list_count',
+}
+
+
+def decrement(counter):
+    # Счетчик мог разойтись из-за правок в админке, ниже нуля не уходим.
+    return Greatest(F(counter) - 1, 0)
+
+
+def lock_user(user, *others):
+    # Строки блокируются по возрастанию pk, чтобы встречные подписки
+    # двух пользователей не ждали друг друга. Рецепты блокируются раньше
+    # пользователей, в том же порядке, что и при пересчете списков покупок.
+    list(User.objects.select_for_update().filter(
+        pk__in=(user.pk, *others)
+    ).order_by('pk').values_list('pk'))
+
+
+def tags_etag(request, *args, **kwargs):
+    return make_etag(Tag._meta.label_lower, get_version(Tag._meta.label_lower))
+
+
+def ingredients_etag(request, *args, **kwargs):
+    return make_etag(
+        Ingredient._meta.label_lower,
+        get_version(Ingredient._meta.label_lower)
+    )
+
+
+def recipe_etag(request, pk=None, **kwargs):
+    try:
+        author_id = Recipe.objects.filter(pk=pk).values_list(
+            'author_id', flat=True
+        ).first()
+    except ValueError:
+        return None
+    if author_id is None:
+        return None
+    user = request.user
+    return make_etag(
+        Recipe._meta.label_lower,
+        pk,
+        get_version(Recipe._meta.label_lower, pk),
+        get_version(User._meta.label_lower, author_id),
+        get_version(Tag._meta.label_lower),
+        get_version(Ingredient._meta.label_lower),
+        user.pk,
+        get_version('viewer', user.pk) if user.is_authenticated else None
+    )
+
+
 class UsersViewSet(UserViewSet):
     queryset = User.objects.all()
     serializer_class = UsersSerializer
     permission_classes = (AllowAny,)
     extra_serializer = FollowSerializer
 
+    def get_recipes_limit(self):
+        return get_int_param(self.request, 'recipes_limit')
+
     @action(detail=False,
             permission_classes=(IsAuthenticated,))
     def subscriptions(self, request):
         user = request.user
-        authors = Follow.objects.filter(user=user)
+        limit = self.get_recipes_limit()
+        authors = Follow.objects.filter(user=user).select_related(
+            'author'
+        ).order_by('id')
         pages = self.paginate_queryset(authors)
+        recipes = defaultdict(list)
+        for recipe in Recipe.objects.top_per_author(
+            [follow.author_id for follow in pages], limit
+        ):
+            recipes[recipe.author_id].append(recipe)
         serializer = self.extra_serializer(
             pages,
             many=True,
-            context={'request': request}
+            context={
+                'request': request,
+                'recipes': recipes,
+                'recipes_limit': limit
+            }
         )
         return self.get_paginated_response(serializer.data)
 
+    @action(methods=['POST', 'DELETE'], detail=False, url_path='subscribe',
+            permission_classes=(IsAuthenticated,))
+    @transaction.atomic
+    def subscribe_bulk(self, request):
+        ids = get_bulk_ids(request)
+        user = request.user
+        if request.method == 'POST':
+            found = set(User.objects.filter(pk__in=ids).exclude(
+                pk=user.pk
+            ).values_list('pk', flat=True))
+            lock_user(user, *found)
+            existing = set(Follow.objects.filter(
+                user=user, author_id__in=found
+            ).values_list('author_id', flat=True))
+            created = found - existing
+            Follow.objects.bulk_create(
+                [Follow(user=user, author_id=pk) for pk in created],
+                ignore_conflicts=True
+            )
+            User.objects.filter(pk__in=created).update(
+                followers_count=F('followers_count') + 1
+            )
+            user_follows_invalidate(user.pk)
+            return bulk_response(ids, {
+                'created': created, 'exists': existing, 'self': {user.pk}
+            })
+        follows = Follow.objects.filter(user=user, author_id__in=ids)
+        lock_user(user, *ids)
+        deleted = set(follows.values_list('author_id', flat=True))
+        follows.delete()
+        User.objects.filter(pk__in=deleted).update(
+            followers_count=decrement('followers_count')
+        )
+        return bulk_response(ids, {'deleted': deleted})
+
     @action(methods=['POST', 'DELETE'], detail=True)
+    @transaction.atomic
     def subscribe(self, request, **kwargs):
         user = request.user
         author = get_object_or_404(User, id=kwargs.get('id'))
+        lock_user(user, author.pk)
         if request.method == 'POST':
+            limit = self.get_recipes_limit()
             if user == author:
                 return Response({
                     'errors': 'Нельзя подписаться на самого себя'},
@@ -54,14 +174,23 @@ class UsersViewSet(UserViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             follow = Follow.objects.create(user=user, author=author)
+            User.objects.filter(pk=author.pk).update(
+                followers_count=F('followers_count') + 1
+            )
             serializer = self.extra_serializer(
-                follow, context={'request': request}
+                follow,
+                context={
+                    'request': request,
+                    'recipes_limit': limit
+                }
             )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         if request.method == 'DELETE':
             follow = Follow.objects.filter(user=user, author=author)
-            if follow.exists():
-                follow.delete()
+            if follow.delete()[0]:
+                User.objects.filter(pk=author.pk).update(
+                    followers_count=decrement('followers_count')
+                )
                 return Response(status=status.HTTP_204_NO_CONTENT)
             return Response(
                 {'errors': 'Подписки не существует'},
@@ -75,6 +204,14 @@ class TagsViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (AllowAny,)
     pagination_class = None
 
+    @method_decorator(condition(etag_func=tags_etag))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @method_decorator(condition(etag_func=tags_etag))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
@@ -84,6 +221,20 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filterset_class = IngredientFilter
     pagination_class = None
 
+    @method_decorator(condition(etag_func=ingredients_etag))
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        ingredients = ingredient_index.search(
+            name, get_int_param(request, 'limit', min_value=1)
+        )
+        return Response(self.get_serializer(ingredients, many=True).data)
+
+    @method_decorator(condition(etag_func=ingredients_etag))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
@@ -92,17 +243,38 @@ class RecipeViewSet(viewsets.ModelViewSet):
     extra_serializer = FavouriteSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    pagination_class = RecipePagination
+
+    def get_queryset(self):
+        user = self.request.user
+        return Recipe.objects.with_user_flags(user).with_author(user)
 
     def get_serializer_class(self):
         if self.request.method in ['POST', 'PUT', 'PATCH']:
             return CreateRecipeSerializer
         return RecipeSerializer
 
+    @method_decorator(condition(etag_func=recipe_etag))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @transaction.atomic
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
+        User.objects.filter(pk=self.request.user.pk).update(
+            recipes_count=F('recipes_count') + 1
+        )
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=decrement('recipes_count')
+        )
 
     @action(detail=True, methods=['POST', 'DELETE'],
             permission_classes=(IsOwnerOrReadOnly,))
+    @transaction.atomic
     def favorite(self, request, **kwargs):
         if request.method == 'POST':
             return self.add_recipe(Favourites, request, kwargs.get('pk'))
@@ -111,42 +283,149 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['POST', 'DELETE'],
             permission_classes=(IsAuthenticated,))
+    @transaction.atomic
     def shopping_cart(self, request, **kwargs):
+        pk = kwargs.get('pk')
         if request.method == 'POST':
-            return self.add_recipe(ShoppingList, request, kwargs.get('pk'))
+            response = self.add_recipe(ShoppingList, request, pk)
+            if response.status_code == status.HTTP_201_CREATED:
+                ShoppingCartIngredient.objects.add_recipes(request.user, [pk])
+            return response
         if request.method == 'DELETE':
-            return self.delete_recipe(ShoppingList, request, kwargs.get('pk'))
+            response = self.delete_recipe(ShoppingList, request, pk)
+            ShoppingCartIngredient.objects.remove_recipes(request.user, [pk])
+            return response
+
+    @action(detail=False, methods=['POST', 'DELETE'], url_path='favorite',
+            permission_classes=(IsAuthenticated,))
+    @transaction.atomic
+    def favorite_bulk(self, request):
+        if request.method == 'POST':
+            return self.bulk_add_recipes(Favourites, request)[1]
+        return self.bulk_delete_recipes(Favourites, request)[1]
+
+    @action(detail=False, methods=['POST', 'DELETE'],
+            url_path='shopping_cart', permission_classes=(IsAuthenticated,))
+    @transaction.atomic
+    def shopping_cart_bulk(self, request):
+        if request.method == 'POST':
+            created, response = self.bulk_add_recipes(ShoppingList, request)
+            ShoppingCartIngredient.objects.add_recipes(request.user, created)
+            return response
+        deleted, response = self.bulk_delete_recipes(ShoppingList, request)
+        ShoppingCartIngredient.objects.remove_recipes(request.user, deleted)
+        return response
 
     @action(
         methods=['GET'],
         detail=False,
-        permission_classes=(IsAuthenticated,)
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=(PlainTextRenderer, CSVRenderer, JSONRenderer)
     )
     def download_shopping_cart(self, request):
-        user = self.request.user
-        ingredients = list(IngredientInRecipe.objects.filter(
-            recipe__shopping_list__user=request.user
+        ingredients = ShoppingCartIngredient.objects.filter(
+            user=request.user
         ).values_list(
             'ingredient__name',
-            'ingredient__measurement_unit'
-        ).order_by('ingredient__name').annotate(
-            ingredient_sum=Sum('amount')
-        ))
-        return create_shopping_list(ingredients=ingredients, user=user)
+            'ingredient__measurement_unit',
+            'amount'
+        ).order_by('ingredient__name')
+        return create_shopping_list(
+            ingredients=ingredients.iterator(),
+            user=request.user,
+            file_format=request.accepted_renderer.format
+        )
+
+    @action(methods=['GET'], detail=False)
+    def what_to_cook(self, request):
+        ingredients = [
+            value
+            for param in request.query_params.getlist('ingredients')
+            for value in param.split(',') if value
+        ]
+        params = WhatToCookSerializer(
+            data={**request.query_params.dict(), 'ingredients': ingredients}
+        )
+        params.is_valid(raise_exception=True)
+        params = params.validated_data
+        matches = recipe_index.search(
+            params['ingredients'],
+            require_all=params['mode'] == 'all',
+            max_missing=params.get('max_missing'),
+            limit=params['limit']
+        )
+        recipes = self.get_queryset().in_bulk([pk for pk, *_ in matches])
+        found = [
+            (recipes[pk], matched, missing)
+            for pk, matched, missing in matches if pk in recipes
+        ]
+        data = self.get_serializer(
+            [recipe for recipe, *_ in found], many=True
+        ).data
+        for item, (_, matched, missing) in zip(data, found):
+            item['matched'] = matched
+            item['missing'] = missing
+        return Response({'results': data})
 
     def add_recipe(self, model, request, pk):
         recipe = get_object_or_404(Recipe, id=pk)
+        Recipe.objects.filter(pk=recipe.pk).lock()
+        lock_user(request.user)
         if model.objects.filter(recipe=recipe, user=request.user).exists():
             return Response(status=status.HTTP_400_BAD_REQUEST)
         instance = model.objects.create(user=request.user, recipe=recipe)
+        counter = RECIPE_COUNTERS[model]
+        Recipe.objects.filter(pk=recipe.pk).update(
+            **{counter: F(counter) + 1}
+        )
         serializer = FavouriteSerializer(
             instance, context={'request': request}
         )
         return Response(data=serializer.data, status=status.HTTP_201_CREATED)
 
+    def bulk_add_recipes(self, model, request):
+        ids = get_bulk_ids(request)
+        user = request.user
+        Recipe.objects.filter(pk__in=ids).lock()
+        lock_user(user)
+        found = set(Recipe.objects.filter(pk__in=ids).values_list(
+            'pk', flat=True
+        ))
+        existing = set(model.objects.filter(
+            user=user, recipe_id__in=found
+        ).values_list('recipe_id', flat=True))
+        created = found - existing
+        model.objects.bulk_create(
+            [model(user=user, recipe_id=pk) for pk in created],
+            ignore_conflicts=True
+        )
+        counter = RECIPE_COUNTERS[model]
+        Recipe.objects.filter(pk__in=created).update(
+            **{counter: F(counter) + 1}
+        )
+        user_recipes_invalidate(user.pk)
+        return created, bulk_response(
+            ids, {'created': created, 'exists': existing}
+        )
+
+    def bulk_delete_recipes(self, model, request):
+        ids = get_bulk_ids(request)
+        Recipe.objects.filter(pk__in=ids).lock()
+        lock_user(request.user)
+        instances = model.objects.filter(user=request.user, recipe_id__in=ids)
+        deleted = set(instances.values_list('recipe_id', flat=True))
+        instances.delete()
+        counter = RECIPE_COUNTERS[model]
+        Recipe.objects.filter(pk__in=deleted).update(
+            **{counter: decrement(counter)}
+        )
+        return deleted, bulk_response(ids, {'deleted': deleted})
+
     def delete_recipe(self, model, request, pk):
-        get_object_or_404(
-            model,
-            user=request.user,
-            recipe=get_object_or_404(Recipe, id=pk)).delete()
+        recipe = get_object_or_404(Recipe, id=pk)
+        Recipe.objects.filter(pk=recipe.pk).lock()
+        lock_user(request.user)
+        get_object_or_404(model, user=request.user, recipe=recipe).delete()
+        counter = RECIPE_COUNTERS[model]
+        Recipe.objects.filter(pk=pk).update(**{counter: decrement(counter)})
         return Response(status=status.HTTP_204_NO_CONTENT)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -33,6 +34,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.QueryStatsMiddleware',
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,6 +86,26 @@ else:
         }
     }
 
+if DEBUG:
+    CACHES = {
+        'default': {
+            'BACKEND': os.getenv('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+            'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', default=10000)),
+            },
+        }
+    }
+else:
+    # Версии для ETag, фрагменты и журнал индекса должны быть общими
+    # для всех воркеров gunicorn.
+    CACHES = {
+        'default': {
+            'BACKEND': os.getenv('CACHE_BACKEND', default='django.core.cache.backends.memcached.PyMemcacheCache'),
+            'LOCATION': os.getenv('CACHE_LOCATION', default='memcached:11211'),
+        }
+    }
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -105,7 +129,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'api.paginators.CustomPagination',
 }
@@ -151,3 +175,36 @@ AUTH_USER_MODEL = 'users.User'
 MAX_LEN_USERS_CHARFIELD = 150
 MAX_LEN_EMAIL_FIELD = 254
 MAX_LEN_RECIPES_FIELD = 200
+
+PAGINATION_COUNT_CACHE_TIMEOUT = int(os.getenv('PAGINATION_COUNT_CACHE_TIMEOUT', default=60))
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = int(os.getenv('PAGINATION_COUNT_ESTIMATE_THRESHOLD', default=100000))
+RECIPE_FRAGMENT_CACHE_TIMEOUT = int(os.getenv('RECIPE_FRAGMENT_CACHE_TIMEOUT', default=3600))
+
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', default=1024))
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', default=60))
+
+BULK_MAX_IDS = int(os.getenv('BULK_MAX_IDS', default=100))
+
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS', default=2))
+RECIPE_IMAGE_MAX_SIZE = int(os.getenv('RECIPE_IMAGE_MAX_SIZE', default=1600))
+RECIPE_IMAGE_VARIANTS = {'card': 600, 'thumb': 240}
+RECIPE_IMAGE_QUALITY = int(os.getenv('RECIPE_IMAGE_QUALITY', default=85))
+RECIPE_IMAGE_MAX_UPLOAD_SIZE = int(os.getenv('RECIPE_IMAGE_MAX_UPLOAD_SIZE', default=10 * 1024 * 1024))
+# Картинка приходит в JSON в base64 (+33%), плюс запас на остальные поля.
+# client_max_body_size в infra/nginx.conf должен быть не меньше.
+DATA_UPLOAD_MAX_MEMORY_SIZE = RECIPE_IMAGE_MAX_UPLOAD_SIZE * 4 // 3 + 1024 * 1024
+
+SQL_QUERY_BUDGET = int(os.getenv('SQL_QUERY_BUDGET', default=50))
+SQL_TIME_BUDGET_MS = int(os.getenv('SQL_TIME_BUDGET_MS', default=200))
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv('SQL_N_PLUS_ONE_THRESHOLD', default=10))
+
+# Пока токен не задан, /api/metrics/ отвечает 403 всем.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', default='')
+
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', default=0))
+PROFILING_DIR = os.getenv('PROFILING_DIR', default=os.path.join(tempfile.gettempdir(), 'foodgram-profiles'))
+# Сколько последних профилей хранить, более старые удаляются.
+PROFILING_MAX_FILES = int(os.getenv('PROFILING_MAX_FILES', default=500))
+
+RECIPE_INDEX_MAX_CHANGES = int(os.getenv('RECIPE_INDEX_MAX_CHANGES', default=1000))
+WHAT_TO_COOK_MAX_LIMIT = int(os.getenv('WHAT_TO_COOK_MAX_LIMIT', default=100))
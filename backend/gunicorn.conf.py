@@ -0,0 +1,23 @@
+import os
+import shutil
+
+# Воркеры пишут метрики в общий каталог, /api/metrics собирает их вместе.
+multiproc_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus'
+)
+
+
+def on_starting(server):
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir)
+    # Не запускаем воркеры с настройками, которые ломают кэш версий.
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+    import django
+    from django.core.management import call_command
+    django.setup()
+    call_command('check', deploy=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 from .models import (Favourites, Ingredient, IngredientInRecipe, Recipe,
-                     ShoppingList, Tag)
+                     ShoppingCartIngredient, ShoppingList, Tag)
 
 
 class IngredientInline(admin.TabularInline):
@@ -30,18 +30,71 @@ class RecipeAdmin(admin.ModelAdmin):
                 for ingredient in obj.ingredients.all()]))
 
     def number_of_likes(self, obj):
-        return obj.favourites.count()
+        return obj.favourites_count
+
+    def save_related(self, request, form, formsets, change):
+        with ShoppingCartIngredient.objects.track_recipes([form.instance]):
+            super().save_related(request, form, formsets, change)
 
 
 @admin.register(ShoppingList)
 class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'recipe')
 
+    def save_model(self, request, obj, form, change):
+        if change:
+            old = ShoppingList.objects.select_related('user').get(pk=obj.pk)
+            ShoppingCartIngredient.objects.remove_recipes(
+                old.user, [old.recipe_id]
+            )
+        super().save_model(request, obj, form, change)
+        ShoppingCartIngredient.objects.add_recipes(obj.user, [obj.recipe_id])
+
+    def delete_model(self, request, obj):
+        ShoppingCartIngredient.objects.remove_recipes(
+            obj.user, [obj.recipe_id]
+        )
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        for row in queryset.select_related('user'):
+            ShoppingCartIngredient.objects.remove_recipes(
+                row.user, [row.recipe_id]
+            )
+        super().delete_queryset(request, queryset)
+
+
+@admin.register(ShoppingCartIngredient)
+class ShoppingCartIngredientAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'ingredient', 'amount')
+
 
 @admin.register(IngredientInRecipe)
 class IngredientsInRecipeAdmin(admin.ModelAdmin):
     list_display = ('id', 'recipe', 'ingredient', 'amount')
 
+    def save_model(self, request, obj, form, change):
+        recipes = [obj.recipe]
+        if change:
+            old = IngredientInRecipe.objects.select_related('recipe').get(
+                pk=obj.pk
+            )
+            if old.recipe_id != obj.recipe_id:
+                recipes.append(old.recipe)
+        with ShoppingCartIngredient.objects.track_recipes(recipes):
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with ShoppingCartIngredient.objects.track_recipes([obj.recipe]):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        recipes = list(Recipe.objects.filter(
+            pk__in=queryset.values('recipe_id')
+        ))
+        with ShoppingCartIngredient.objects.track_recipes(recipes):
+            super().delete_queryset(request, queryset)
+
 
 @admin.register(Favourites)
 class FavoriteAdmin(admin.ModelAdmin):
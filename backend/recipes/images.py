@@ -0,0 +1,158 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_PROCESSING_WORKERS,
+    thread_name_prefix='recipe-images'
+)
+
+
+def schedule_image_processing(recipe):
+    """Обработка картинки рецепта в фоне после коммита транзакции"""
+    name = recipe.image.name
+    if name:
+        transaction.on_commit(
+            lambda: executor.submit(process_image, recipe.pk, name)
+        )
+
+
+def load_image(content):
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(content)))
+    image.load()
+    return image
+
+
+def encode_image(image, size, extension):
+    variant = image.copy()
+    variant.thumbnail((size, size))
+    output = io.BytesIO()
+    if extension == 'webp':
+        variant.save(output, 'WEBP', quality=settings.RECIPE_IMAGE_QUALITY)
+    elif extension == 'png':
+        variant.save(output, 'PNG', optimize=True)
+    else:
+        variant.convert('RGB').save(
+            output,
+            'JPEG',
+            quality=settings.RECIPE_IMAGE_QUALITY,
+            optimize=True,
+            progressive=True
+        )
+    return ContentFile(output.getvalue())
+
+
+def variant_names(variants):
+    return [name for formats in variants.values() for name in formats.values()]
+
+
+def referenced_images(names=None):
+    """Имена файлов, на которые ссылаются рецепты"""
+    recipes = Recipe.objects.all()
+    if names is not None:
+        query = Q(image__in=names)
+        for name in names:
+            query |= Q(image_variants__icontains=name)
+        recipes = recipes.filter(query)
+    referenced = set()
+    for image, variants in recipes.values_list(
+        'image', 'image_variants'
+    ).iterator():
+        referenced.add(image)
+        referenced.update(variant_names(variants))
+    return referenced
+
+
+def unused_images(names, modified_before, referenced=None):
+    """Файлы, которые не нужны ни одному рецепту"""
+    storage = Recipe._meta.get_field('image').storage
+    names = set(filter(None, names))
+    if referenced is None:
+        referenced = referenced_images(names)
+    unused = []
+    for name in names - referenced:
+        try:
+            if storage.get_modified_time(name) < modified_before:
+                unused.append(name)
+        except FileNotFoundError:
+            pass
+    return unused
+
+
+def delete_unused_images(names, modified_before, referenced=None):
+    storage = Recipe._meta.get_field('image').storage
+    unused = unused_images(names, modified_before, referenced)
+    for name in unused:
+        storage.delete(name)
+    return unused
+
+
+def delete_saved_images(names):
+    """Удаляет только что записанные файлы, не нужные другим рецептам"""
+    # Проверка возраста из delete_unused_images здесь не подходит:
+    # эти файлы всегда моложе начала обработки.
+    storage = Recipe._meta.get_field('image').storage
+    names = set(names)
+    for name in names - referenced_images(names):
+        storage.delete(name)
+
+
+def process_image(recipe_id, name):
+    storage = Recipe._meta.get_field('image').storage
+    started = timezone.now()
+    saved = []
+
+    def save(image, size, extension):
+        saved.append(storage.save(
+            os.path.join(directory, f'image.{extension}'),
+            encode_image(image, size, extension)
+        ))
+        return saved[-1]
+
+    try:
+        with storage.open(name) as file:
+            image = load_image(file.read())
+        directory = os.path.dirname(name)
+        extension = (
+            'png' if image.mode in ('RGBA', 'LA')
+            or 'transparency' in image.info else 'jpg'
+        )
+        sizes = {'full': settings.RECIPE_IMAGE_MAX_SIZE}
+        sizes.update(settings.RECIPE_IMAGE_VARIANTS)
+        variants = {
+            label: {
+                image_format: save(image, size, image_format)
+                for image_format in (extension, 'webp')
+            }
+            for label, size in sizes.items()
+        }
+        with transaction.atomic():
+            recipe = Recipe.objects.select_for_update().filter(
+                pk=recipe_id, image=name
+            ).first()
+            if recipe is not None:
+                obsolete = [name, *variant_names(recipe.image_variants)]
+                recipe.image.name = variants['full'][extension]
+                recipe.image_variants = variants
+                recipe.save(update_fields=('image', 'image_variants'))
+        if recipe is None:
+            delete_saved_images(saved)
+        else:
+            delete_unused_images(obsolete, started)
+    except Exception:
+        logger.exception('Не удалось обработать картинку %s', name)
+        delete_saved_images(saved)
+    finally:
+        connections.close_all()
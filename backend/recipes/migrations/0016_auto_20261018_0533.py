@@ -0,0 +1,57 @@
+# Generated by Django 3.2.14 on 2026-10-18 02:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_shopping_carts(apps, schema_editor):
+    ShoppingList = apps.get_model('recipes', 'ShoppingList')
+    ShoppingCartIngredient = apps.get_model(
+        'recipes', 'ShoppingCartIngredient'
+    )
+    ShoppingCartIngredient.objects.bulk_create(
+        [ShoppingCartIngredient(
+            user_id=user_id, ingredient_id=ingredient_id, amount=total
+        )
+        for user_id, ingredient_id, total in ShoppingList.objects.filter(
+            recipe__ingredients_in_recipe__isnull=False
+        ).values_list(
+            'user_id', 'recipe__ingredients_in_recipe__ingredient_id'
+        ).annotate(
+            total=models.Sum('recipe__ingredients_in_recipe__amount')
+        ).order_by().iterator()],
+        batch_size=5000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0015_recipe_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingCartIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_ingredients', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_ingredients', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Ингредиент в списке покупок',
+                'verbose_name_plural': 'Ингредиенты в списках покупок',
+                'default_related_name': 'shopping_cart_ingredients',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcartingredient',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_cart_ingredient'),
+        ),
+        migrations.RunPython(
+            fill_shopping_carts, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.14 on 2026-10-18 02:34
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count(model, field):
+    return Coalesce(models.Subquery(
+        model.objects.filter(**{field: models.OuterRef('pk')}).values(
+            field
+        ).annotate(total=models.Count('pk')).values('total')
+    ), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    User = apps.get_model('users', 'User')
+    Recipe.objects.update(
+        favourites_count=count(apps.get_model('recipes', 'Favourites'), 'recipe'),
+        shopping_list_count=count(apps.get_model('recipes', 'ShoppingList'), 'recipe')
+    )
+    User.objects.update(
+        recipes_count=count(Recipe, 'author'),
+        followers_count=count(apps.get_model('users', 'Follow'), 'author')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_auto_20261018_0534'),
+        ('recipes', '0016_auto_20261018_0533'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favourites_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_list_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='В списках покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
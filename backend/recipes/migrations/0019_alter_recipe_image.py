@@ -0,0 +1,19 @@
+# Generated by Django 3.2.14 on 2026-10-18 02:40
+
+from django.db import migrations, models
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0018_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(blank=True, storage=recipes.storage.ContentHashStorage(), upload_to='recipes/media/', verbose_name='Изображение рецепта'),
+        ),
+    ]
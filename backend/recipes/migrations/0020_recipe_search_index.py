@@ -0,0 +1,102 @@
+from django.db import migrations
+
+POSTGRESQL_INSTALL = (
+    'ALTER TABLE recipes_recipe ADD COLUMN search_vector tsvector',
+    '''
+    CREATE OR REPLACE FUNCTION recipes_recipe_search_vector_update()
+    RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('russian', coalesce(NEW.name, '')), 'A')
+            || setweight(to_tsvector('russian', coalesce(NEW.text, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipe_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, text ON recipes_recipe
+    FOR EACH ROW EXECUTE FUNCTION recipes_recipe_search_vector_update()
+    ''',
+    '''
+    UPDATE recipes_recipe SET search_vector =
+        setweight(to_tsvector('russian', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('russian', coalesce(text, '')), 'B')
+    ''',
+    'CREATE INDEX recipes_recipe_search_idx '
+    'ON recipes_recipe USING gin (search_vector)',
+)
+POSTGRESQL_UNINSTALL = (
+    'DROP TRIGGER recipes_recipe_search_vector_trigger ON recipes_recipe',
+    'DROP FUNCTION recipes_recipe_search_vector_update()',
+    'ALTER TABLE recipes_recipe DROP COLUMN search_vector',
+)
+
+# Пересоздание таблицы рецептов в SQLite удаляет эти триггеры,
+# поэтому при изменении Recipe миграцию индекса нужно повторить.
+SQLITE_INSTALL = (
+    '''
+    CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5(
+        name, text, content='recipes_recipe', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipe_fts_insert AFTER INSERT ON recipes_recipe
+    BEGIN
+        INSERT INTO recipes_recipe_fts (rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipe_fts_delete AFTER DELETE ON recipes_recipe
+    BEGIN
+        INSERT INTO recipes_recipe_fts (recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipe_fts_update
+    AFTER UPDATE OF name, text ON recipes_recipe
+    BEGIN
+        INSERT INTO recipes_recipe_fts (recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO recipes_recipe_fts (rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    ''',
+    "INSERT INTO recipes_recipe_fts (recipes_recipe_fts) VALUES ('rebuild')",
+)
+SQLITE_UNINSTALL = (
+    'DROP TRIGGER recipes_recipe_fts_insert',
+    'DROP TRIGGER recipes_recipe_fts_delete',
+    'DROP TRIGGER recipes_recipe_fts_update',
+    'DROP TABLE recipes_recipe_fts',
+)
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, ()):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0019_alter_recipe_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({
+                'postgresql': POSTGRESQL_INSTALL,
+                'sqlite': SQLITE_INSTALL
+            }),
+            run({
+                'postgresql': POSTGRESQL_UNINSTALL,
+                'sqlite': SQLITE_UNINSTALL
+            })
+        ),
+    ]
@@ -1,9 +1,21 @@
+import re
+from collections import defaultdict
+from contextlib import contextmanager
+
 from colorfield.fields import ColorField
 from django.conf import settings
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import (BooleanField, Exists, F, FloatField, OuterRef,
+                              Prefetch, Q, Sum, Value, Window)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+
+from recipes.storage import ContentHashStorage
+from users.models import Follow, User
 
-from users.models import User
+SEARCH_WORDS = re.compile(r'\w+')
+SEARCH_MAX_WORDS = 10
 
 
 class Tag(models.Model):
@@ -58,6 +70,117 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Выборка рецептов с флагами текущего пользователя"""
+
+    def with_user_flags(self, user):
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField())
+            )
+        return self.annotate(
+            is_favorited=Exists(Favourites.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingList.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            ))
+        )
+
+    def with_author(self, user):
+        authors = User.objects.all()
+        if not user.is_anonymous:
+            authors = authors.annotate(is_subscribed=Exists(
+                Follow.objects.filter(user=user, author=OuterRef('pk'))
+            ))
+        return self.prefetch_related(Prefetch('author', queryset=authors))
+
+    @staticmethod
+    def details_lookups():
+        return (
+            'tags',
+            Prefetch(
+                'ingredients_in_recipe',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                )
+            )
+        )
+
+    def search(self, query):
+        """Полнотекстовый поиск по названию и описанию с ранжированием"""
+        words = SEARCH_WORDS.findall(query.lower())[:SEARCH_MAX_WORDS]
+        if not words:
+            return self
+        vendor = connections[self.db].vendor
+        if vendor == 'postgresql':
+            match = ' & '.join(f'{word}:*' for word in words)
+            condition = RawSQL(
+                "recipes_recipe.search_vector @@ to_tsquery('russian', %s)",
+                (match,),
+                output_field=BooleanField()
+            )
+            rank = RawSQL(
+                'ts_rank(recipes_recipe.search_vector, '
+                "to_tsquery('russian', %s))",
+                (match,),
+                output_field=FloatField()
+            )
+        elif vendor == 'sqlite':
+            # bm25 считается только в запросе с MATCH, поэтому таблица
+            # индекса соединяется по rowid, а не опрашивается на каждую строку.
+            match = ' AND '.join(f'"{word}"*' for word in words)
+            return self.extra(
+                select={
+                    'search_rank': '-bm25(recipes_recipe_fts, 10.0, 1.0)'
+                },
+                tables=('recipes_recipe_fts',),
+                where=(
+                    'recipes_recipe_fts.rowid = recipes_recipe.id',
+                    'recipes_recipe_fts MATCH %s',
+                ),
+                params=(match,)
+            ).order_by('-search_rank', '-pub_date', 'id')
+        else:
+            condition = Q()
+            for word in words:
+                condition &= Q(name__icontains=word) | Q(text__icontains=word)
+            rank = Value(0.0, output_field=FloatField())
+        return self.filter(condition).annotate(search_rank=rank).order_by(
+            '-search_rank', '-pub_date', 'id'
+        )
+
+    def with_details(self):
+        return self.prefetch_related(*self.details_lookups())
+
+    def lock(self):
+        """Блокирует рецепты до конца транзакции в порядке возрастания pk"""
+        list(self.select_for_update().order_by('pk').values_list('pk'))
+
+    def top_per_author(self, author_ids, limit=None):
+        """Последние рецепты авторов, не больше limit на каждого"""
+        recipes = self.filter(author_id__in=author_ids).order_by(
+            'author_id', '-pub_date', '-id'
+        )
+        if limit is None:
+            return recipes
+        ranked = recipes.order_by().annotate(recipe_rank=Window(
+            expression=RowNumber(),
+            partition_by=F('author_id'),
+            order_by=(F('pub_date').desc(), F('id').desc())
+        )).values(
+            'id', 'author_id', 'name', 'image', 'image_variants',
+            'cooking_time', 'pub_date', 'recipe_rank'
+        )
+        sql, params = ranked.query.sql_with_params()
+        return self.raw(
+            f'SELECT * FROM ({sql}) ranked WHERE recipe_rank <= %s '
+            'ORDER BY author_id, pub_date DESC, id DESC',
+            (*params, limit)
+        )
+
+
 class Recipe(models.Model):
     """Модель рецепта"""
     author = models.ForeignKey(
@@ -77,6 +200,12 @@ class Recipe(models.Model):
     image = models.ImageField(
         verbose_name='Изображение рецепта',
         upload_to='recipes/media/',
+        storage=ContentHashStorage(),
+        blank=True
+    )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии изображения',
+        default=dict,
         blank=True
     )
     name = models.CharField(
@@ -97,12 +226,27 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True
     )
+    favourites_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='В избранном'
+    )
+    shopping_list_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='В списках покупок'
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         default_related_name = 'recipes'
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = (
+            models.Index(
+                fields=('-pub_date', 'id'), name='recipe_pub_date_id_idx'
+            ),
+        )
 
     def __str__(self):
         return self.name[:50]
@@ -184,3 +328,147 @@ class ShoppingList(models.Model):
                 name='unique_recipe_in_shopping_list'
             )
         ]
+
+
+class ShoppingCartIngredientQuerySet(models.QuerySet):
+    """Поддержка суммарного списка покупок в актуальном состоянии"""
+
+    def apply_deltas(self, deltas):
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        user_ids = sorted({user_id for user_id, _ in deltas})
+        ingredient_ids = {ingredient_id for _, ingredient_id in deltas}
+        with transaction.atomic():
+            list(User.objects.select_for_update().filter(
+                pk__in=user_ids
+            ).order_by('pk').values_list('pk'))
+            rows = {
+                (row.user_id, row.ingredient_id): row
+                for row in self.filter(
+                    user_id__in=user_ids, ingredient_id__in=ingredient_ids
+                )
+            }
+            created, updated, deleted = [], [], []
+            for (user_id, ingredient_id), delta in deltas.items():
+                row = rows.get((user_id, ingredient_id))
+                if row is None:
+                    if delta > 0:
+                        created.append(self.model(
+                            user_id=user_id,
+                            ingredient_id=ingredient_id,
+                            amount=delta
+                        ))
+                    continue
+                row.amount += delta
+                if row.amount > 0:
+                    updated.append(row)
+                else:
+                    deleted.append(row.pk)
+            self.bulk_create(created)
+            self.bulk_update(updated, ('amount',))
+            self.filter(pk__in=deleted).delete()
+
+    def add_recipes(self, user, recipe_ids, sign=1):
+        # Правка рецепта ждет блокировки, поэтому дельты считаются
+        # по тому же набору ингредиентов, что увидит change_recipe.
+        Recipe.objects.filter(pk__in=recipe_ids).lock()
+        deltas = defaultdict(int)
+        for ingredient_id, amount in IngredientInRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('ingredient_id', 'amount'):
+            deltas[user.pk, ingredient_id] += sign * amount
+        self.apply_deltas(deltas)
+
+    def remove_recipes(self, user, recipe_ids):
+        self.add_recipes(user, recipe_ids, sign=-1)
+
+    def change_recipe(self, recipe, old_amounts, new_amounts):
+        """Пересчет для всех, у кого рецепт в списке покупок"""
+        Recipe.objects.filter(pk=recipe.pk).lock()
+        changes = {
+            ingredient_id: (
+                new_amounts.get(ingredient_id, 0)
+                - old_amounts.get(ingredient_id, 0)
+            )
+            for ingredient_id in {*old_amounts, *new_amounts}
+        }
+        self.apply_deltas({
+            (user_id, ingredient_id): delta
+            for user_id in ShoppingList.objects.filter(
+                recipe=recipe
+            ).values_list('user_id', flat=True)
+            for ingredient_id, delta in changes.items()
+        })
+
+    def remove_recipe(self, recipe):
+        Recipe.objects.filter(pk=recipe.pk).lock()
+        self.change_recipe(recipe, self.recipe_amounts(recipe), {})
+
+    def recipe_amounts(self, recipe):
+        return dict(IngredientInRecipe.objects.filter(
+            recipe_id=recipe.pk
+        ).values_list('ingredient_id', 'amount'))
+
+    @contextmanager
+    def track_recipes(self, recipes):
+        """Переносит в списки покупок правки ингредиентов внутри блока"""
+        Recipe.objects.filter(pk__in=[recipe.pk for recipe in recipes]).lock()
+        old_amounts = [self.recipe_amounts(recipe) for recipe in recipes]
+        yield
+        for recipe, amounts in zip(recipes, old_amounts):
+            self.change_recipe(recipe, amounts, self.recipe_amounts(recipe))
+
+    def expected(self):
+        """Суммы, посчитанные заново по спискам покупок"""
+        return ShoppingList.objects.filter(
+            recipe__ingredients_in_recipe__isnull=False
+        ).values_list(
+            'user_id', 'recipe__ingredients_in_recipe__ingredient_id'
+        ).annotate(
+            total=Sum('recipe__ingredients_in_recipe__amount')
+        ).order_by()
+
+    def rebuild(self, batch_size=5000):
+        with transaction.atomic():
+            self.all().delete()
+            batch = []
+            for user_id, ingredient_id, total in self.expected().iterator():
+                batch.append(self.model(
+                    user_id=user_id, ingredient_id=ingredient_id, amount=total
+                ))
+                if len(batch) >= batch_size:
+                    self.bulk_create(batch)
+                    batch = []
+            self.bulk_create(batch)
+
+
+class ShoppingCartIngredient(models.Model):
+    """Модель суммарных ингредиентов в списке покупок пользователя"""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+    )
+    amount = models.PositiveIntegerField(verbose_name='Количество')
+
+    objects = ShoppingCartIngredientQuerySet.as_manager()
+
+    class Meta:
+        default_related_name = 'shopping_cart_ingredients'
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списках покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_cart_ingredient'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient}-{self.amount}'[:100]
@@ -0,0 +1,31 @@
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentHashStorage(FileSystemStorage):
+    """Хранилище, которое называет файлы по sha256 их содержимого"""
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        name = os.path.join(
+            os.path.dirname(name),
+            digest.hexdigest() + os.path.splitext(name)[1].lower()
+        )
+        if self.exists(name):
+            # Свежее время изменения защищает файл от сборщика мусора,
+            # пока ссылающийся на него рецепт ещё не сохранён.
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length)
@@ -26,6 +26,14 @@ class User(AbstractUser):
         unique=True,
         max_length=settings.MAX_LEN_EMAIL_FIELD
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество рецептов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество подписчиков'
+    )
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
 